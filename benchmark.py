@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+'''Benchmark test suite wall time and per-command round-trip latency.'''
+
+from __future__ import print_function
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from electronics_test import FarmduinoTestSuite, CarbonCopy
+from plan_compiler import CATEGORIES, compile_plan, load_plan
+
+BASELINE_FILE = 'benchmark_baseline.json'
+PERCENTILES = [50, 95, 99]
+REGRESSION_SLACK = 1.0  # ms, ignore smaller differences (timer noise)
+
+
+def percentile(values, percent):
+    '''Nearest-rank percentile of the provided values.'''
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, int(math.ceil(percent / 100. * len(ordered))))
+    return ordered[rank - 1]
+
+
+def summarize(values):
+    '''Count, mean, and percentiles (in milliseconds) of durations.'''
+    summary = {'count': len(values),
+               'mean': round(sum(values) / len(values) * 1000, 3)}
+    for percent in PERCENTILES:
+        summary['p{}'.format(percent)] = round(
+            percentile(values, percent) * 1000, 3)
+    return summary
+
+
+class BenchmarkSuite(FarmduinoTestSuite):
+    '''Test suite that records the round-trip time of each command.'''
+
+    def __init__(self, port=None):
+        super(BenchmarkSuite, self).__init__(port)
+        self.latencies = {}
+
+    def check_output(self, command_io, test_type):
+        '''Record the round-trip time of the command and check its output.'''
+        if command_io['axis'] in [None, 'X']:  # once per combined move
+            code = command_io['command'].split(' ')[0]
+            self.latencies.setdefault(code, []).append(command_io['latency'])
+        return super(BenchmarkSuite, self).check_output(command_io, test_type)
+
+
+def run_benchmark(port, iterations, board='1', plan_file=None):
+    '''Run the test plan repeatedly and summarize the timing.'''
+    suite = BenchmarkSuite(port)
+    stdout = sys.stdout
+    devnull = open(os.devnull, 'w')
+    sys.stdout = suite.copy_stdout = CarbonCopy(stdout=devnull, copy=False)
+    suite_times = []
+    category_times = dict((category, []) for category in CATEGORIES)
+    try:
+        suite.options = {'prompts': False, 'verbose': False}
+        suite.set_newline()
+        suite.select_board(auto_run=True, board=board)
+        suite.connect_to_board(auto_run=True)
+        schedule = compile_plan(load_plan(plan_file),
+                                suite.board_info['board'])
+        for _ in range(iterations):
+            start = time.time()
+            for category, elapsed in suite.run_plan(schedule).items():
+                category_times[category].append(elapsed)
+            suite_times.append(time.time() - start)
+        suite.exit(auto_run=True)
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+    return {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+        'iterations': iterations,
+        'board': suite.board_info['firmware'],
+        'suite': summarize(suite_times),
+        'categories': dict((category, summarize(times))
+                           for category, times in category_times.items()),
+        'commands': dict((code, summarize(times))
+                         for code, times in suite.latencies.items()),
+        }
+
+
+def print_report(results):
+    '''Print the benchmark results.'''
+    print('{line}\nBENCHMARK RESULTS ({iterations} iterations, {board})\n'
+          '{line}'.format(line='=' * 60, iterations=results['iterations'],
+                          board=results['board']))
+    row = '{:12}{:>8}{:>10}{:>10}{:>10}{:>10}'
+    print(row.format('NAME', 'COUNT', 'MEAN (ms)', 'P50', 'P95', 'P99'))
+    rows = ([('suite', results['suite'])]
+            + sorted(results['categories'].items())
+            + sorted(results['commands'].items()))
+    for name, summary in rows:
+        print(row.format(name, summary['count'], summary['mean'],
+                         summary['p50'], summary['p95'], summary['p99']))
+    print('=' * 60)
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    '''List regressions greater than the tolerance (fraction) vs baseline.'''
+    regressions = []
+    pairs = [('suite', results['suite'], baseline['suite'])]
+    for code, summary in sorted(results['commands'].items()):
+        if code in baseline['commands']:
+            pairs.append((code, summary, baseline['commands'][code]))
+    for name, current, previous in pairs:
+        for key in ['p50', 'p95']:
+            limit = previous[key] * (1 + tolerance) + REGRESSION_SLACK
+            if current[key] > limit:
+                regressions.append('{} {}: {} ms (baseline {} ms)'.format(
+                    name, key, current[key], previous[key]))
+    return regressions
+
+
+def main():
+    '''Run the benchmark against a simulated or connected board.'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port',
+                        help='board port (default: simulated board)')
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--board', choices=['0', '1'], default='1',
+                        help='0 for RAMPS, 1 for Farmduino')
+    parser.add_argument('--plan', help='test plan file (default plan if not'
+                        ' provided)')
+    parser.add_argument('--time-scale', type=float, default=10.0,
+                        help='simulated board speed-up')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='simulated board reply latency (seconds)')
+    parser.add_argument('--save', nargs='?', const=BASELINE_FILE,
+                        help='save results as the baseline file')
+    parser.add_argument('--compare', nargs='?', const=BASELINE_FILE,
+                        help='compare results to the baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown vs baseline (fraction)')
+    args = parser.parse_args()
+
+    simulator = None
+    port = args.port
+    if port is None:
+        from firmware_simulator import FirmwareSimulator
+        simulator = FirmwareSimulator(
+            board='R' if args.board == '0' else 'F', latency=args.latency,
+            time_scale=args.time_scale, seed=0)
+        simulator.start()
+        port = simulator.port
+    try:
+        results = run_benchmark(port, args.iterations, args.board, args.plan)
+    finally:
+        if simulator is not None:
+            simulator.stop()
+    results['time_scale'] = None if args.port else args.time_scale
+    print_report(results)
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print('Baseline saved to {}'.format(args.save))
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION: {}'.format(regression))
+        if regressions:
+            sys.exit(1)
+        print('No regressions vs {}'.format(args.compare))
+
+
+if __name__ == '__main__':
+    main()
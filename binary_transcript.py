@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+
+'''Store serial transcripts as fixed-width binary records for fast search.'''
+
+from __future__ import print_function
+import argparse
+import calendar
+import json
+import mmap
+import re
+import struct
+import threading
+import time
+from firmware_io import LINE_ENDING
+from serial_transcript import (CLEARED, RECEIVED, SENT, TIMED_OUT,
+                               TRANSCRIPT_VERSION, TranscriptRecorder,
+                               event_lines, read_transcript, write_transcript)
+
+BINARY_MAGIC = b'FBTR'
+BINARY_EXTENSION = '.bin'
+TEXT_EXTENSION = '.txt'
+INDEX_EXTENSION = '.idx'
+INDEX_BLOCK = 1024  # records per index entry (time range and codes)
+CONTINUED = '+'  # record kind: more text of the previous record
+FILE_HEADER = struct.Struct('<4sHI')  # magic, version, header JSON length
+PAYLOAD_SIZE = 17  # bytes of packed fields or text in each 32-byte record
+# Seconds from start, kind, flags, code letter and number, Q tag, field
+# count, payload
+RECORD = struct.Struct('<dcBcBHB{}s'.format(PAYLOAD_SIZE))
+RECORD_START = struct.Struct('<dcBcB')  # read to filter records
+FIELD = struct.Struct('<Bi')  # letter and decimal places, scaled value
+MAX_FIELDS = PAYLOAD_SIZE // FIELD.size
+MAX_DECIMALS = 7  # decimal places of a packed value (3 bits)
+NO_Q_TAG = 0xFFFF
+LINE_END = 1  # flag: the line was followed by LINE_ENDING
+TEXT = 2  # flag: the payload is text, not packed fields
+MORE = 4  # flag: the text continues in the next record
+CODE = re.compile(r'^([A-Z])(\d{2,3})$')
+NUMBER = re.compile(r'^([A-Z])(-?)(\d+)(?:\.(\d+))?$')
+TEXT_LABELS = {SENT: 'SENDING:', RECEIVED: 'RECEIVED:'}
+TEXT_EVENT = re.compile(r'^\s*(SENDING|SENT|RECEIVED):\s+(.*)$')
+TIMEOUT_TEXT = '***  RESPONSE TIMEOUT  ***'  # as printed by the test suite
+
+
+def _format_number(letter, decimals, value):
+    '''Field text of a packed number (`X-0.50`).'''
+    digits = str(abs(value)).rjust(decimals + 1, '0')
+    if decimals:
+        digits = '{}.{}'.format(digits[:-decimals], digits[-decimals:])
+    return '{}{}{}'.format(letter, '-' if value < 0 else '', digits)
+
+
+def _pack_number(part):
+    '''Letter, decimal places, and scaled value of a field (or None).'''
+    match = NUMBER.match(part)
+    if match is None:
+        return None
+    letter, sign, whole, fraction = match.groups()
+    fraction = fraction or ''
+    value = int(whole + fraction) * (-1 if sign else 1)
+    if len(fraction) > MAX_DECIMALS or not -2 ** 31 <= value < 2 ** 31:
+        return None
+    return letter, len(fraction), value
+
+
+def _pack_code(code):
+    '''Letter and number of a code (`R82`), or empty if it has none.'''
+    match = CODE.match(code)
+    if match is None or int(match.group(2)) > 255:
+        return b'\0', 0
+    return match.group(1).encode(), int(match.group(2))
+
+
+def _unpack_code(letter, number):
+    '''Code text from its letter and number.'''
+    if letter == b'\0':
+        return ''
+    return '{}{:02d}'.format(letter.decode(), number)
+
+
+def pack_line(line):
+    '''Code, Q tag, and packed fields of a line. The fields are None if the
+    line cannot be rebuilt exactly from them (it is then kept as text).'''
+    parts = line.split(' ')
+    code = _unpack_code(*_pack_code(parts[0]))
+    if code != parts[0]:
+        code = ''
+    q_tag = NO_Q_TAG
+    if code and len(parts) > 1 and parts[-1][:1] == 'Q':
+        tag = parts[-1][1:]
+        if tag.isdigit() and int(tag) < NO_Q_TAG:
+            q_tag = int(tag)
+            parts.pop()
+    fields = [_pack_number(part) for part in parts[1:]]
+    if (not code or len(fields) > MAX_FIELDS or None in fields
+            or format_line(code, fields, q_tag) != line):
+        return code, None, None
+    return code, q_tag, fields
+
+
+def format_line(code, fields, q_tag):
+    '''Line text from a code, packed fields, and Q tag.'''
+    parts = [code] + [_format_number(*field) for field in fields]
+    if q_tag != NO_Q_TAG:
+        parts.append('Q{}'.format(q_tag))
+    return ' '.join(parts)
+
+
+def _index_record(blocks, number, seconds, code):
+    '''Add a record to the index (time range and codes of each block).'''
+    if number % INDEX_BLOCK == 0:
+        blocks.append([seconds, seconds, []])
+    block = blocks[-1]
+    block[0] = min(block[0], seconds)
+    block[1] = max(block[1], seconds)
+    if code and code not in block[2]:
+        block[2].append(code)
+
+
+class BinaryTranscriptRecorder(object):
+    '''Save timestamped serial lines as fixed-width binary records.
+
+    The file is a header (magic, version, JSON header object) followed by
+    records appended as lines are sent and received. Response and command
+    lines are packed into numeric fields; other lines are kept as text.
+    An index of the time range and codes of each block of records is
+    written next to the file when it is closed. Takes the same events as
+    TranscriptRecorder.
+    '''
+
+    def __init__(self, filename, header, start=None):
+        self.filename = filename
+        self.file = open(filename, 'wb')
+        self.start = time.time() if start is None else start
+        self.lock = threading.Lock()
+        self.partial = (0, b'')  # received data without a line ending
+        self.count = 0
+        self.blocks = []
+        header = dict(header, version=TRANSCRIPT_VERSION, started=self.start)
+        header = json.dumps(header, sort_keys=True).encode()
+        self.file.write(FILE_HEADER.pack(BINARY_MAGIC, TRANSCRIPT_VERSION,
+                                         len(header)) + header)
+
+    def _write_record(self, seconds, kind, flags=0, code='', q_tag=NO_Q_TAG,
+                      count=0, payload=b''):
+        '''Append a record.'''
+        self.file.write(RECORD.pack(
+            seconds, kind.encode(), flags, *(_pack_code(code) + (
+                q_tag, count, payload))))
+        _index_record(self.blocks, self.count, seconds,
+                      None if kind == CONTINUED else code)
+        self.count += 1
+
+    def _write_line(self, seconds, kind, line, flags):
+        '''Append the records of a line.'''
+        code, q_tag, fields = pack_line(line)
+        if fields is not None:
+            self._write_record(
+                seconds, kind, flags, code, q_tag, len(fields),
+                b''.join(FIELD.pack(
+                    (ord(letter) - ord('A')) << 3 | decimals, value)
+                    for letter, decimals, value in fields))
+            return
+        text = line.encode('latin-1')
+        chunks = [text[i:i + PAYLOAD_SIZE]
+                  for i in range(0, len(text), PAYLOAD_SIZE)]
+        for i, chunk in enumerate(chunks or [b'']):
+            more = MORE if i < len(chunks) - 1 else 0
+            self._write_record(seconds, CONTINUED if i else kind,
+                               flags | TEXT | more, code, NO_Q_TAG,
+                               len(chunk), chunk)
+
+    def add_event(self, seconds, kind, data=b''):
+        '''Add an event (seconds from the start of the transcript).'''
+        with self.lock:
+            if self.file is None:
+                return
+            if kind not in (SENT, RECEIVED):
+                self._write_record(seconds, kind)
+                return
+            if kind == RECEIVED:
+                data = self.partial[1] + data
+            lines = data.split(LINE_ENDING.encode())
+            partial = lines.pop()
+            for line in lines:
+                self._write_line(seconds, kind, line.decode('latin-1'),
+                                 LINE_END)
+            if kind == RECEIVED:
+                self.partial = (seconds, partial)
+            elif partial:
+                self._write_line(seconds, kind, partial.decode('latin-1'), 0)
+
+    def _add(self, timestamp, kind, data=b''):
+        '''Add an event.'''
+        self.add_event(round(timestamp - self.start, 6), kind, data)
+
+    def sent(self, timestamp, data):
+        '''Add data written to the board.'''
+        self._add(timestamp, SENT, data)
+
+    def received(self, timestamp, data):
+        '''Add data read from the board.'''
+        self._add(timestamp, RECEIVED, data)
+
+    def cleared(self, timestamp):
+        '''Add the discarding of queued responses.'''
+        self._add(timestamp, CLEARED)
+
+    def timed_out(self, timestamp):
+        '''Add a response timeout.'''
+        self._add(timestamp, TIMED_OUT)
+
+    def close(self):
+        '''Finish the transcript and write its index.'''
+        with self.lock:
+            seconds, partial = self.partial
+            if partial:  # incomplete last line
+                self._write_line(seconds, RECEIVED,
+                                 partial.decode('latin-1'), 0)
+            self.file.close()
+            self.file = None
+        with open(self.filename + INDEX_EXTENSION, 'w') as index_file:
+            json.dump({'records': self.count, 'blocks': self.blocks},
+                      index_file)
+
+
+class BinaryTranscript(object):
+    '''Random access to the records of a binary transcript.
+
+    The file is memory-mapped, so records are decoded only when they are
+    read. `search` skips blocks of records that the index shows have no
+    matching code or time. The index is rebuilt if it is missing or out of
+    date (for example, after a recording was interrupted).
+    '''
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _version, length = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != BINARY_MAGIC:
+            self.close()
+            raise ValueError('not a binary transcript: {}'.format(filename))
+        self.data_start = FILE_HEADER.size + length
+        self.header = json.loads(
+            self.map[FILE_HEADER.size:self.data_start].decode())
+        # A partly written last record is ignored
+        self.count = (len(self.map) - self.data_start) // RECORD.size
+        self.blocks = self._load_index(filename + INDEX_EXTENSION)
+
+    def __len__(self):
+        '''Number of records.'''
+        return self.count
+
+    def close(self):
+        '''Close the file.'''
+        self.map.close()
+        self.file.close()
+
+    def _offset(self, number):
+        '''Position of a record in the file.'''
+        return self.data_start + number * RECORD.size
+
+    def _load_index(self, filename):
+        '''Read the index, or build it from the records.'''
+        try:
+            with open(filename) as index_file:
+                index = json.load(index_file)
+            if index['records'] == self.count:
+                return index['blocks']
+        except (IOError, ValueError, KeyError):
+            pass
+        blocks = []
+        for number in range(self.count):
+            seconds, kind, _flags, letter, code = RECORD_START.unpack_from(
+                self.map, self._offset(number))
+            code = None if kind == CONTINUED.encode() else (
+                _unpack_code(letter, code))
+            _index_record(blocks, number, seconds, code)
+        return blocks
+
+    def record(self, number):
+        '''Seconds from the start, kind, line (None for a clear or timeout),
+        and whether the line was followed by LINE_ENDING.'''
+        (seconds, kind, flags, letter, code, q_tag, count,
+         payload) = RECORD.unpack_from(self.map, self._offset(number))
+        kind = kind.decode()
+        if kind not in (SENT, RECEIVED):
+            return seconds, kind, None, False
+        if not flags & TEXT:
+            fields = [FIELD.unpack_from(payload, i * FIELD.size)
+                      for i in range(count)]
+            line = format_line(_unpack_code(letter, code), [
+                (chr((packed >> 3) + ord('A')), packed & MAX_DECIMALS, value)
+                for packed, value in fields], q_tag)
+            return seconds, kind, line, bool(flags & LINE_END)
+        text = [payload[:count]]
+        while flags & MORE and number + 1 < self.count:
+            number += 1
+            _, _, flags, _, _, _, count, payload = RECORD.unpack_from(
+                self.map, self._offset(number))
+            text.append(payload[:count])
+        return (seconds, kind, b''.join(text).decode('latin-1'),
+                bool(flags & LINE_END))
+
+    def search(self, codes=None, kinds=None, since=None, until=None):
+        '''Yield the number, seconds, kind, and line of the records with
+        one of the codes and kinds, in a time range (seconds from start).'''
+        for block_number, (first, last, block_codes) in enumerate(
+                self.blocks):
+            if ((since is not None and last < since)
+                    or (until is not None and first >= until)
+                    or (codes and not set(codes) & set(block_codes))):
+                continue
+            start = block_number * INDEX_BLOCK
+            for number in range(start, min(start + INDEX_BLOCK, self.count)):
+                seconds, kind, _flags, letter, code = (
+                    RECORD_START.unpack_from(self.map, self._offset(number)))
+                kind = kind.decode()
+                if (kind == CONTINUED or (kinds and kind not in kinds)
+                        or (since is not None and seconds < since)
+                        or (until is not None and seconds >= until)
+                        or (codes and _unpack_code(letter, code)
+                            not in codes)):
+                    continue
+                yield (number,) + self.record(number)[:3]
+
+    def events(self):
+        '''Events in the form of read_transcript (one line per event).'''
+        events = []
+        for number in range(self.count):
+            seconds, kind, line, ended = self.record(number)
+            if kind == CONTINUED:
+                continue
+            events.append([seconds, kind, (line or '') + (
+                LINE_ENDING if ended else '')])
+        return events
+
+
+def is_binary_transcript(filename):
+    '''Determine if the file is a binary transcript.'''
+    with open(filename, 'rb') as transcript:
+        return transcript.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def open_recorder(filename, header):
+    '''Start a transcript in the format of the file name extension.'''
+    if filename.endswith(BINARY_EXTENSION):
+        return BinaryTranscriptRecorder(filename, header)
+    return TranscriptRecorder(filename, header)
+
+
+def load_transcript(filename):
+    '''Load a binary or JSON transcript. Return the header and events.'''
+    if not is_binary_transcript(filename):
+        return read_transcript(filename)
+    transcript = BinaryTranscript(filename)
+    try:
+        return transcript.header, transcript.events()
+    finally:
+        transcript.close()
+
+
+def write_binary(filename, header, events):
+    '''Save a header and events as a binary transcript.'''
+    recorder = BinaryTranscriptRecorder(filename, header,
+                                        start=header.get('started'))
+    for seconds, kind, data in events:
+        recorder.add_event(seconds, kind, data.encode('latin-1'))
+    recorder.close()
+
+
+def text_lines(header, events):
+    '''Lines of a transcript in the style of the results file.'''
+    yield '{:11}{}'.format('BOARD:', header.get('board'))
+    yield '{:11}{} UTC'.format('TEST DATE:', time.strftime(
+        '%Y-%m-%d %H:%M', time.gmtime(header.get('started', 0))))
+    for _seconds, kind, line in event_lines(events):
+        if kind == TIMED_OUT:
+            yield TIMEOUT_TEXT
+        elif kind in TEXT_LABELS:
+            yield '{:11}{}'.format(TEXT_LABELS[kind], line)
+
+
+def read_text(filename):
+    '''Load the commands, responses, and timeouts shown in a results file
+    (or text transcript). The file has no timestamps, so all events are at
+    the test date.'''
+    header = {'board': None, 'port': None, 'plan': None, 'started': 0}
+    events = []
+    last_sent = None
+    untagged = None  # sent event that takes the tag of its shown response
+    with open(filename) as text_file:
+        for line in text_file:
+            line = line.rstrip('\r\n')
+            if line.startswith('BOARD:'):
+                header['board'] = line.split(':', 1)[1].strip()
+            elif line.startswith('TEST DATE:'):
+                header['started'] = calendar.timegm(time.strptime(
+                    line.split(':', 1)[1].strip(), '%Y-%m-%d %H:%M UTC'))
+            elif TIMEOUT_TEXT in line:
+                events.append([0.0, TIMED_OUT, ''])
+            match = TEXT_EVENT.match(line)
+            if match is None:
+                continue
+            label, text = match.groups()
+            if label == 'RECEIVED':
+                # `R84 X0 Y0 Z0 Q0 (R85 X0 Y0 Z0 Q0)` shows two responses
+                for response in re.split(r' \((?=R\d+ )|\)$', text):
+                    if response and response != 'None':
+                        events.append([0.0, RECEIVED, response + LINE_ENDING])
+                        q_tag = response.split(' ')[-1]
+                        if untagged is not None and q_tag.startswith('Q'):
+                            untagged[2] = '{} {}{}'.format(
+                                last_sent, q_tag, LINE_ENDING)
+                        untagged = None
+                continue
+            command = re.sub(r' \(\d+ samples\)$', '', text)
+            if label == 'SENT' and command == last_sent:
+                continue  # repeated with the details of a failed check
+            last_sent = command
+            untagged = [0.0, SENT, command + LINE_ENDING]
+            events.append(untagged)
+    return header, events
+
+
+def convert(source, target):
+    '''Convert a transcript between binary (.bin), results file text
+    (.txt), and JSON formats (chosen by file name extension).'''
+    if source.endswith(TEXT_EXTENSION):
+        header, events = read_text(source)
+    else:
+        header, events = load_transcript(source)
+    if target.endswith(BINARY_EXTENSION):
+        write_binary(target, header, events)
+    elif target.endswith(TEXT_EXTENSION):
+        with open(target, 'w') as text_file:
+            for line in text_lines(header, events):
+                text_file.write(line + '\n')
+    else:
+        write_transcript(target, header, events)
+
+
+def main():
+    '''Convert or search transcripts.'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest='action')
+    subparsers.required = True
+    converter = subparsers.add_parser(
+        'convert', help='convert between .bin, .txt, and JSON (.gz)')
+    converter.add_argument('source')
+    converter.add_argument('target')
+    searcher = subparsers.add_parser('search', help='list matching lines')
+    searcher.add_argument('transcript', help='binary transcript')
+    searcher.add_argument('--code', action='append',
+                          help='response or command code (repeatable)')
+    searcher.add_argument('--kind', choices=[SENT, RECEIVED],
+                          help='w for sent, r for received')
+    searcher.add_argument('--since', type=float,
+                          help='seconds from the start of the transcript')
+    searcher.add_argument('--until', type=float,
+                          help='seconds from the start, exclusive')
+    args = parser.parse_args()
+    if args.action == 'convert':
+        convert(args.source, args.target)
+        return
+    transcript = BinaryTranscript(args.transcript)
+    try:
+        for _number, seconds, kind, line in transcript.search(
+                args.code, args.kind and [args.kind], args.since, args.until):
+            print('{:12.6f}  {:11}{}'.format(
+                seconds, TEXT_LABELS.get(kind, ''),
+                TIMEOUT_TEXT if kind == TIMED_OUT else line or 'CLEARED'))
+    finally:
+        transcript.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+'''Find connected boards and read their firmware versions in parallel.'''
+
+from __future__ import print_function
+import threading
+import time
+import serial
+from serial.tools import list_ports
+from firmware_io import LineReader, is_ready_response
+
+PROBE_TIMEOUT = 5  # seconds for a board to boot and report its version
+WATCH_INTERVAL = 0.2  # seconds between checks for new ports
+
+
+def candidate_ports():
+    '''List the USB serial ports currently connected.'''
+    return sorted(port.device for port in list_ports.comports()
+                  if port.vid is not None)
+
+
+def _wait_for(reader, deadline, condition):
+    '''Wait for a response that meets the condition (or None at deadline).'''
+    while True:
+        response = reader.read_response(deadline - time.time())
+        if response is None or condition(response):
+            return response
+
+
+def probe_port(port, keep_open=False):
+    '''Read the firmware version of the board on the port.
+
+    Returns a dictionary with `port` and `firmware` (None if the firmware
+    did not respond or the port is in use). With `keep_open`, the connection
+    and reader of a responding board are included as `serial` and `reader`.
+    '''
+    board = {'port': port, 'firmware': None, 'serial': None, 'reader': None}
+    try:
+        connection = serial.Serial(port, 115200, exclusive=True)
+    except serial.SerialException:
+        return board  # busy (for example, being tested) or unplugged
+    reader = LineReader(connection)
+    reader.start()
+    deadline = time.time() + PROBE_TIMEOUT
+    if _wait_for(reader, deadline, is_ready_response) is not None:
+        connection.write('F83\r\n'.encode())
+        version = _wait_for(reader, deadline,
+                            lambda response: response.code == 'R83')
+        if version is not None:
+            board['firmware'] = version.data
+    if keep_open and board['firmware'] is not None:
+        board['serial'], board['reader'] = connection, reader
+    else:
+        reader.stop()
+        connection.close()
+    return board
+
+
+def close_board(board):
+    '''Close a connection kept open by probe_port.'''
+    if board['reader'] is not None:
+        board['reader'].stop()
+        board['serial'].close()
+
+
+def discover_boards(ports=None, keep_open=False):
+    '''Probe ports (all candidates by default) at the same time.
+
+    Returns the boards that reported a firmware version, sorted by port.
+    '''
+    if ports is None:
+        ports = candidate_ports()
+    boards = [None] * len(ports)
+
+    def probe(index, port):
+        '''Probe a port (in its own thread).'''
+        boards[index] = probe_port(port, keep_open)
+    threads = [threading.Thread(target=probe, args=(i, port))
+               for i, port in enumerate(ports)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [board for board in boards if board['firmware'] is not None]
+
+
+class PortWatcher(object):
+    '''Call a function with each serial port that appears.'''
+
+    def __init__(self, on_added, on_removed=None, ignore_current=False):
+        self.on_added = on_added
+        self.on_removed = on_removed
+        self.ports = set(candidate_ports()) if ignore_current else set()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        '''Begin watching for ports.'''
+        self.running = True
+        self.thread = threading.Thread(target=self._watch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        '''Stop watching for ports.'''
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _watch(self):
+        '''Check for added and removed ports.'''
+        while self.running:
+            ports = set(candidate_ports())
+            for port in sorted(ports - self.ports):
+                self.on_added(port)
+            if self.on_removed is not None:
+                for port in sorted(self.ports - ports):
+                    self.on_removed(port)
+            self.ports = ports
+            time.sleep(WATCH_INTERVAL)
+
+
+if __name__ == '__main__':
+    for found in discover_boards():
+        print('{port}: {firmware}'.format(**found))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+'''Timestamps of each command exchange and their latency breakdown.'''
+
+from __future__ import division
+from collections import namedtuple
+
+PHASES = ['link', 'firmware', 'total']
+
+
+def _timestamp(response):
+    '''Time a response was received (None if there was no response).'''
+    return None if response is None else response.timestamp
+
+
+def finish_time(log):
+    '''Time the firmware finished a command (None if not seen).'''
+    return _timestamp(log.latest('R02') or log.latest('R03'))
+
+
+class CommandTiming(namedtuple('CommandTiming', [
+        'command', 'sent', 'ready', 'first_byte', 'started', 'finished',
+        'matched', 'received'])):
+    '''Times (UNIX seconds, None if not seen) a command was written, the
+    firmware was free to take it (the previous pipelined command finished),
+    its first response arrived, the firmware started (R01) and finished
+    (R02/R03) it, the checked response arrived, and output was complete.'''
+    __slots__ = ()
+
+    @property
+    def code(self):
+        '''Command code (`G00`).'''
+        return self.command.split(' ')[0]
+
+    def phases(self):
+        '''Seconds until the firmware acknowledged the command (link, not
+        counting time queued behind earlier commands), until it finished it
+        (firmware, including motor travel), and in total.'''
+        acknowledged = self.started or self.first_byte
+        finished = self.finished or self.received
+        if acknowledged is None:
+            return {'link': None, 'firmware': None,
+                    'total': self.received - self.sent}
+        return {'link': max(0, acknowledged - self.ready),
+                'firmware': max(0, finished - acknowledged),
+                'total': self.received - self.sent}
+
+
+def timing_from_log(command, sent, log, marker, received, ready=None):
+    '''Timing of a command from its firmware output (a ResponseLog).'''
+    return CommandTiming(
+        command, sent, sent if ready is None else ready,
+        _timestamp(log.first), _timestamp(log.latest('R01')),
+        finish_time(log), _timestamp(log.latest(marker)), received)
+
+
+class TimingLog(object):
+    '''Command timings of a test run, with hooks for external profilers.'''
+
+    def __init__(self):
+        self.timings = []
+        self.timeouts = 0
+        self.hooks = []
+
+    def add_hook(self, hook):
+        '''Call `hook(timing)` with the CommandTiming of each command.'''
+        self.hooks.append(hook)
+
+    def add(self, timing):
+        '''Add the timing of a command.'''
+        self.timings.append(timing)
+        for hook in self.hooks:
+            hook(timing)
+
+    def add_timeout(self):
+        '''Count a response timeout.'''
+        self.timeouts += 1
+
+    def breakdown(self):
+        '''Count and mean phase durations (ms) of each command code, and the
+        maximum total.'''
+        phases = {}
+        for timing in self.timings:
+            code_phases = phases.setdefault(
+                timing.code, dict((phase, []) for phase in PHASES))
+            for phase, duration in timing.phases().items():
+                if duration is not None:
+                    code_phases[phase].append(duration * 1000)
+        summary = {}
+        for code, durations in phases.items():
+            summary[code] = dict(
+                (phase, round(sum(values) / len(values), 2) if values
+                 else None) for phase, values in durations.items())
+            summary[code]['count'] = len(durations['total'])
+            summary[code]['max'] = round(max(durations['total']), 2)
+        return summary
+
+    def slowest(self, count):
+        '''Commands with the longest total time.'''
+        return sorted(self.timings, reverse=True,
+                      key=lambda timing: timing.phases()['total'])[:count]
@@ -3,11 +3,24 @@
 '''Test FarmBot Arduino/Farmduino electronics with basic firmware commands.'''
 
 from __future__ import print_function
+import os
 import sys
 import time
-import subprocess
+from collections import deque
 import serial
 import firmware_parameters
+from command_timing import TimingLog, finish_time, timing_from_log
+from firmware_io import LineReader, ResponseLog, is_ready_response
+import board_discovery
+from plan_compiler import (CATEGORIES, STATISTIC_CONDITION, compile_plan,
+                           history_priorities, load_plan)
+from response_timeouts import ResponseTimeouts, UNRESPONSIVE_AFTER
+from result_records import TestRecord, export_records
+from results_store import RESULTS_DATABASE, ResultsStore
+from binary_transcript import load_transcript, open_recorder
+from serial_transcript import TranscriptReplay
+from streaming_stats import RunningStats
+from telemetry import MoveTelemetry
 
 HEADER = '''
 FarmBot electronics board test commands
@@ -20,13 +33,21 @@ Press <Enter> at prompts to use (default value)
 EXPECTED_FIRMWARE_VERSION = '6.4.0'
 RAMPS_PERIPHERAL_PINS = [13, 10, 9, 8]
 FARMDUINO_PERIPHERAL_PINS = [13, 7, 8, 9, 10, 12]
-SOIL_PIN = 59
-EXPECTED_SOIL_SENSOR_VALUE = '>1000'
-TOOL_PIN = 63
-EXPECTED_TOOL_VERIFICATION_PIN_VALUE = 1
+MOVEMENT_STEPS = 200
+ENCODER_THRESHOLD = 5  # steps of allowed motor/encoder position difference
+ANALOG_NOISE_LIMIT = 20  # standard deviation allowed for sampled reads
+COMBINED_MOVEMENT = True  # move all axes at once (results still per axis)
+BATCH_PIN_TESTS = True  # set and read back all pins in one burst
+CROSSTALK_PIN_TESTS = False  # use bit patterns that reveal cross-talk
+TELEMETRY_SAMPLES = 256  # position reports kept for each move
+TEST_PLAN = None  # test plan file (None for plans/default.json)
+SLOWEST_COMMANDS = 5  # number of slowest commands listed in the results
 
 RAMPS = '0'
 FARMDUINO = '1'
+BOARDS = {RAMPS: {'name': 'RAMPS', 'versions': ['R']},
+          FARMDUINO: {'name': 'Farmduino', 'versions': ['F', 'G']}}
+DETECT_BOARDS = True  # find the board and its type from the firmware version
 
 if sys.platform.startswith('linux'):
     DEFAULT_PORT = '/dev/ttyACM0'
@@ -35,9 +56,22 @@ elif sys.platform.startswith('darwin'):
 else:
     DEFAULT_PORT = 'COM2'
 
-RESPONSE_TIMEOUT = 6  # seconds
+RESPONSE_TIMEOUT = 6  # seconds, for status reports (commands use estimates)
+BOOT_TIMEOUT = 5  # seconds to wait for the firmware after opening the port
+CONNECTION_ATTEMPTS = 3
+CONNECTION_RETRY_DELAY = 0.5  # seconds, doubled after each attempt
+PIPELINE_WINDOW = 3  # commands in flight (firmware serial buffer is 64 bytes)
+SYNC_PARAMETERS = True  # only write parameters that differ from the board
 PRINT_FIRMWARE_OUTPUT = False  # for debugging
 USE_STM32_RESET = False  # as position reset method
+FLUSH_INTERVAL = 1  # seconds between saves of the results file during a run
+EXPORT_FORMATS = ['json', 'csv', 'junit']  # saved next to the results file
+SAVE_HISTORY = True  # add each run to the results database
+HISTORY_ORDERING = True  # run the checks that failed most often first
+FAIL_FAST = False  # in run mode 3, stop at the test plan's fail_fast limits
+# Used when terminfo is unavailable
+ANSI_CODES = {'red': '\033[31m', 'green': '\033[32m',
+              'bold': '\033[1m', 'reset': '\033[0m'}
 
 
 def time_elapsed(begin, end):
@@ -47,26 +81,89 @@ def time_elapsed(begin, end):
 
 def time_test(function):
     '''Time the tests in the category.'''
-    def wrapper(*args):
+    def wrapper(*args, **kwargs):
         '''Calculate time elapsed.'''
         start_time = time.time()
-        function(*args)
+        function(*args, **kwargs)
         end_time = time.time()
         return time_elapsed(start_time, end_time)
     return wrapper
 
 
+def board_from_version(firmware_version):
+    '''Get the board selection code for a firmware version (`6.4.0.F`).'''
+    suffix = firmware_version.split('.')[-1]
+    for code, board in BOARDS.items():
+        if suffix in board['versions']:
+            return code
+    return None
+
+
+def pin_patterns(count, crosstalk=False):
+    '''On/off patterns for output pins: all on, then all off.
+
+    With `crosstalk`, each pin instead gets the bits of its index and their
+    complements, so every pin is read both on and off and any two pins
+    differ in at least one pattern (2 * ceil(log2(count)) patterns).
+    '''
+    if not crosstalk:
+        return [[1] * count, [0] * count]
+    bits = max(1, (count - 1).bit_length())
+    patterns = []
+    for bit in range(bits):
+        pattern = [(index >> bit) & 1 for index in range(count)]
+        patterns.extend([[1 - value for value in pattern], pattern])
+    return patterns
+
+
+def get_parameter_values():
+    '''Firmware parameter values written by the suite (number: value).'''
+    values = {}
+    parameters = firmware_parameters.GenerateParameters().parameters
+    for axes in parameters.values():
+        for axis in axes:
+            values[axis['num']] = axis['value']
+    return values
+
+
+def terminal_codes(stream):
+    '''Look up color escape sequences for the stream (none if not a TTY).'''
+    try:
+        if not stream.isatty():
+            return dict.fromkeys(ANSI_CODES, '')
+    except (AttributeError, ValueError):
+        return dict.fromkeys(ANSI_CODES, '')
+    try:
+        import curses
+        curses.setupterm(fd=stream.fileno())
+        set_color = curses.tigetstr('setaf')
+        codes = {'red': curses.tparm(set_color, 1),
+                 'green': curses.tparm(set_color, 2),
+                 'bold': curses.tigetstr('bold'),
+                 'reset': curses.tigetstr('sgr0')}
+    except Exception:  # no curses module or terminfo entry
+        return dict(ANSI_CODES)
+    if any(code is None for code in codes.values()):
+        return dict(ANSI_CODES)
+    return dict((name, code.decode('ascii'))
+                for name, code in codes.items())
+
+
 def display_warning(text):
     '''Print a warning message.'''
     print('{icon}  {warning}  {icon}'.format(
         icon='*' * 3, warning=text.upper()))
 
 
+class TestsAborted(Exception):
+    '''A fail-fast limit was reached; the remaining tests are skipped.'''
+
+
 class FarmduinoTestSuite(object):
     '''Test suite.'''
 
-    def __init__(self):
-        self.connection = {'serial': None, 'port': None}
+    def __init__(self, port=None):
+        self.connection = {'serial': None, 'port': port, 'reader': None}
         self.options = {'prompts': True, 'verbose': True}
         self.newline = '\n'
         self.test_results = {
@@ -80,6 +177,24 @@ class FarmduinoTestSuite(object):
             'board': None, 'firmware': None, 'expected_versions': None}
         self.run_mode = None
         self.copy_stdout = None
+        self.results_file = '{board}_board-test-results.txt'
+        self.status = None
+        self.q_tag = 0
+        self.test_name = None
+        self.records = []
+        self.move_metrics = []
+        self.plan_file = TEST_PLAN
+        self.timing = TimingLog()
+        self.timeouts = ResponseTimeouts(get_parameter_values())
+        self.timing.add_hook(self.timeouts.observe)
+        self.record_file = None  # save the serial transcript of the run
+        self.recorder = None
+        self.replaying = False
+        self.fail_fast = FAIL_FAST
+        self.abort_rules = {}  # category: failed checks that stop the run
+        self.aborted = None
+        self.history = None  # failure rates of earlier runs
+        self.keep_connection = False  # leave the port open after the run
 
     def _get_input(self, prompt_text):
         '''Prompt user for input.'''
@@ -89,64 +204,141 @@ class FarmduinoTestSuite(object):
 
     def select_port(self):
         '''Select the port of the connected board to test.'''
+        default_port = self.connection['port'] or DEFAULT_PORT
         self.connection['port'] = (
-            self._get_input('serial port ({}): '.format(DEFAULT_PORT))
-            or DEFAULT_PORT)
+            self._get_input('serial port ({}): '.format(default_port))
+            or default_port)
         self.copy_stdout.append_newline()
 
-    def select_board(self, auto_run):
+    def select_board(self, auto_run, board=FARMDUINO):
         '''Choose a board to test.'''
         while True:
             if auto_run:
-                selected_board = FARMDUINO
+                selected_board = board
             else:
                 selected_board = (
                     self._get_input(
-                        'Board to test? 0 for RAMPS, 1 for Farmduino (1): ')
-                    or FARMDUINO)
-            if selected_board == RAMPS:
-                self.board_info['board'] = 'RAMPS'
-                self.board_info['expected_versions'] = [
-                    EXPECTED_FIRMWARE_VERSION + '.R']
-                break
-            elif selected_board == FARMDUINO:
-                self.board_info['board'] = 'Farmduino'
+                        'Board to test? 0 for RAMPS, 1 for Farmduino ({}): '
+                        .format(board))
+                    or board)
+            if selected_board in BOARDS:
+                self.board_info['board'] = BOARDS[selected_board]['name']
                 self.board_info['expected_versions'] = [
-                    EXPECTED_FIRMWARE_VERSION + '.F',
-                    EXPECTED_FIRMWARE_VERSION + '.G']
+                    '{}.{}'.format(EXPECTED_FIRMWARE_VERSION, version)
+                    for version in BOARDS[selected_board]['versions']]
                 break
         sys.stdout.bold()
         print('{} selected.'.format(self.board_info['board']))
         sys.stdout.reset_color()
 
+    def use_board(self, board):
+        '''Test a board with a connection kept open by board_discovery.'''
+        self.connection.update(
+            port=board['port'], serial=board['serial'], reader=board['reader'])
+        self.board_info['firmware'] = board['firmware']
+
+    def choose_board(self, boards, auto_run):
+        '''Choose one of several boards that responded.'''
+        print('Found {} boards:'.format(len(boards)))
+        numbers = [str(number) for number in range(1, len(boards) + 1)]
+        for number, board in zip(numbers, boards):
+            print('{}: {port} (firmware {firmware})'.format(number, **board))
+        default = '1'  # the board at the default port, if any
+        for number, board in zip(numbers, boards):
+            if board['port'] == DEFAULT_PORT:
+                default = number
+        while True:
+            if auto_run:
+                selected = default
+            else:
+                selected = self._get_input(
+                    'Board to test? ({}): '.format(default)) or default
+            if selected in numbers:
+                return boards[int(selected) - 1]
+
+    def detect_board(self, auto_run=False):
+        '''Find a board and keep its connection open. Return the board type.'''
+        if self.connection['serial'] is None:
+            if not DETECT_BOARDS:
+                return None
+            ports = None
+            if self.connection['port'] is not None:
+                ports = [self.connection['port']]
+            boards = board_discovery.discover_boards(ports, keep_open=True)
+            if not boards:
+                return None
+            board = boards[0]
+            if len(boards) > 1:
+                board = self.choose_board(boards, auto_run)
+            for other_board in boards:
+                if other_board is not board:
+                    board_discovery.close_board(other_board)
+            self.use_board(board)
+        print('Found firmware {} at {}.'.format(
+            self.board_info['firmware'], self.connection['port']))
+        return board_from_version(self.board_info['firmware'])
+
     def connect_to_board(self, auto_run=False):
         '''Connect to the board.'''
         while True:
+            detected_port = None
+            if self.connection['serial'] is not None:
+                detected_port = self.connection['port']
             if auto_run:
-                self.connection['port'] = DEFAULT_PORT
+                if self.connection['port'] is None:
+                    self.connection['port'] = DEFAULT_PORT
             else:
                 self.select_port()
-            print('Trying to connect to {}...'.format(self.connection['port']))
-            try:
-                self.connection['serial'] = serial.Serial(
-                    self.connection['port'], 115200)
-            except serial.serialutil.SerialException:
-                print('Serial Error: no connection to {}'.format(
-                    self.connection['port']))
+            if detected_port == self.connection['port']:
+                status = 'ready'  # already connected by detect_board
             else:
-                time.sleep(2)
+                if detected_port is not None:
+                    self._close_connection()
+                    self.connection['serial'] = None
+                print('Trying to connect to {}...'.format(
+                    self.connection['port']))
+                status = self._connect()
+            if status == 'ready':
                 sys.stdout.bold()
                 print('Connected!', end='\n\n')
                 sys.stdout.reset_color()
                 break
-        # Check for firmware
-        response = ''
-        while self.connection['serial'].in_waiting > 0:
-            response += self.connection['serial'].read()
-        if 'R' not in response:
-            print('\nfirmware error: not detected\n'.upper())
-            print('Exiting...')
-            sys.exit(0)
+            if status == 'no firmware':
+                print('\nfirmware error: not detected\n'.upper())
+            if status == 'no firmware' or auto_run:
+                print('Exiting...')
+                sys.exit(0)
+
+    def _connect(self):
+        '''Open the port and wait for the firmware, retrying with backoff.'''
+        status = 'no connection'
+        delay = CONNECTION_RETRY_DELAY
+        for attempt in range(CONNECTION_ATTEMPTS):
+            if attempt > 0:
+                time.sleep(delay)
+                delay *= 2
+            try:
+                self._open_connection()
+            except serial.serialutil.SerialException:
+                print('Serial Error: no connection to {}'.format(
+                    self.connection['port']))
+                continue
+            if self._wait_for_ready():
+                return 'ready'
+            status = 'no firmware'
+            self._close_connection()
+        return status
+
+    def _wait_for_ready(self):
+        '''Wait until the firmware reports startup complete or idle.'''
+        deadline = time.time() + BOOT_TIMEOUT
+        while True:
+            response = self.connection['reader'].read_response(
+                deadline - time.time())
+            if response is None:
+                return False
+            if is_ready_response(response):
+                return True
 
     def prompt_for_run_mode(self, auto_run=False):
         '''Ask user for desired test suite run mode.'''
@@ -197,23 +389,191 @@ class FarmduinoTestSuite(object):
         else:
             self.newline = ''
 
-    def send_command(self, command, expected=None, test_type='misc', quiet=False):
-        '''Send a command and print the output.'''
+    def _new_command_io(self, command, expected, test_type):
+        '''Create the command_io object for a command.'''
         command_io = {'command': command, 'marker': None, 'expected': expected,
-                      'received': None, 'R85': None, 'out': '', 'output': None,
-                      'result': 'FAIL'}
+                      'received': None, 'R85': None, 'out': ResponseLog(),
+                      'output': None, 'result': 'FAIL', 'latency': None,
+                      'axis': None, 'telemetry': None, 'samples': None}
         if expected is not None:  # count as a test
             self.update_test_results('count', test_type)
+        command_io['marker'] = self.get_response_marker(command)
+        if command.startswith('G0'):
+            command_io['telemetry'] = MoveTelemetry(TELEMETRY_SAMPLES)
+        return command_io
+
+    def send_command(self, command, expected=None, test_type='misc', quiet=False):
+        '''Send a command and print the output.'''
+        command_io = self._new_command_io(command, expected, test_type)
+        self._transmit(command_io, quiet)
+        return self.check_output(command_io, test_type)
+
+    def _transmit(self, command_io, quiet=False):
+        '''Send the command and collect its firmware output.'''
         # Clear input buffer
-        self.connection['serial'].reset_input_buffer()
+        self._clear_input()
         # Send the command
         if self.options['verbose'] and not quiet:
             print('{:11}{}'.format('SENDING:', command_io['command']))
-        self.connection['serial'].write(command + '\r\n')
+        start_time = time.time()
+        q_tag = self._next_q_tag()
+        self._write('{} Q{}'.format(command_io['command'], q_tag))
         # prep for receiving output
-        command_io['marker'] = self.get_response_marker(command)
-        command_io['out'] = self.get_output()
+        command_io['out'] = self.get_output(
+            telemetry=command_io['telemetry'],
+            timeout=self.timeouts.for_command(command_io['command']),
+            q_tag=q_tag)
+        self._record_timing(command_io, start_time, time.time())
+        if command_io['telemetry'] is not None:
+            self.move_metrics.append({
+                'test': self.test_name, 'command': command_io['command'],
+                'axes': command_io['telemetry'].metrics()})
+
+    def _clear_input(self):
+        '''Discard queued responses, noting late replies to earlier
+        commands (the board is responding again).'''
+        for response in self.connection['reader'].clear():
+            self.timeouts.observe_response(response)
+
+    def _write(self, command):
+        '''Write a command line to the board (and to the transcript).'''
+        data = (command + '\r\n').encode()
+        if self.recorder is not None:
+            self.recorder.sent(time.time(), data)
+        self.connection['serial'].write(data)
+
+    def _record_timing(self, command_io, sent, received, ready=None):
+        '''Save the latency and timing breakdown of a command.'''
+        command_io['latency'] = received - sent
+        self.timing.add(timing_from_log(
+            command_io['command'], sent, command_io['out'],
+            command_io['marker'], received, ready))
+
+    def _next_q_tag(self):
+        '''Get the next queue number for tagging a command.'''
+        self.q_tag = self.q_tag % 999 + 1
+        return str(self.q_tag)
+
+    def send_commands(self, commands):
+        '''Send queue-tagged commands while earlier responses are pending.
+
+        Each command is a dictionary with a `command` and optional `title`,
+        `expected`, `test_type`, and `samples` (number of times to send a
+        read, checking statistics of the values). Responses are matched to
+        commands by Q number and checked in order. Returns the output of
+        each command.
+        '''
+        reader = self.connection['reader']
+        self._clear_input()
+        queued = deque(command for command in commands
+                       for _ in range(command.get('samples', 1)))
+        pending = deque()
+        tagged = {}
+        outputs = []
+        sampled = []  # entries of the sampled read in progress
+        previous_finish = 0  # when the firmware finished the last command
+        while queued or pending:
+            while queued and len(pending) < PIPELINE_WINDOW:
+                entry = {'command': queued.popleft(), 'log': ResponseLog(),
+                         'tag': self._next_q_tag(), 'done': False,
+                         'start': time.time()}
+                entry['timeout'] = self.timeouts.for_command(
+                    entry['command']['command'])
+                entry['deadline'] = entry['start'] + entry['timeout']
+                entry['end'] = entry['deadline']
+                pending.append(entry)
+                tagged[entry['tag']] = entry
+                self._write('{} Q{}'.format(
+                    entry['command']['command'], entry['tag']))
+            while pending and not pending[0]['done']:
+                response = reader.read_response(
+                    pending[0]['deadline'] - time.time())
+                if response is None:
+                    self._response_timeout()
+                    pending[0]['done'] = True
+                    break
+                self.timeouts.observe_response(response)
+                entry = tagged.get(response.q_tag)
+                if entry is None:  # not a response to a pending command
+                    continue
+                entry['log'].append(response)
+                if self._is_last_response(response):
+                    entry['done'] = True
+                    entry['end'] = time.time()
+            while pending and pending[0]['done']:
+                entry = pending.popleft()
+                del tagged[entry['tag']]
+                entry['ready'] = max(entry['start'], previous_finish)
+                previous_finish = finish_time(entry['log']) or 0
+                if 'samples' not in entry['command']:
+                    outputs.append(self._check_pipelined_output(entry))
+                    continue
+                sampled.append(entry)
+                if len(sampled) == entry['command']['samples']:
+                    outputs.append(self._check_sampled_output(sampled))
+                    sampled = []
+            if pending:  # wait from when the command reached the front
+                pending[0]['deadline'] = max(
+                    pending[0]['deadline'],
+                    time.time() + pending[0]['timeout'])
+        return outputs
+
+    def _check_pipelined_output(self, entry):
+        '''Print and check the response to a command sent by send_commands.'''
+        command = entry['command']
+        test_type = command.get('test_type', 'misc')
+        if command.get('title') is not None:
+            self.print_test_title(command['title'])
+        command_io = self._new_command_io(
+            command['command'], command.get('expected'), test_type)
+        if self.options['verbose']:
+            print('{:11}{}'.format('SENDING:', command_io['command']))
+        command_io['out'] = entry['log']
+        self._record_timing(
+            command_io, entry['start'], entry['end'], entry['ready'])
+        return self.check_output(command_io, test_type)
+
+    def _check_sampled_output(self, entries):
+        '''Print and check statistics of the values of a sampled read.'''
+        command = entries[0]['command']
+        test_type = command.get('test_type', 'misc')
+        if command.get('title') is not None:
+            self.print_test_title(command['title'])
+        expected = command.get('expected')
+        if expected is not None and ' sd' not in expected:
+            expected += ' sd<{}'.format(ANALOG_NOISE_LIMIT)
+        command_io = self._new_command_io(
+            command['command'], expected, test_type)
+        command_io['samples'] = RunningStats()
+        if self.options['verbose']:
+            print('{:11}{} ({} samples)'.format(
+                'SENDING:', command_io['command'], len(entries)))
+        for entry in entries:
+            command_io['out'] = entry['log']
+            self._record_timing(
+                command_io, entry['start'], entry['end'], entry['ready'])
+            self.reduce_output(command_io, command_io['marker'])
+            if command_io['output'] is not None:
+                command_io['samples'].add(
+                    int(command_io['output'].split('V')[-1]))
+        command_io['latency'] = entries[-1]['end'] - entries[0]['start']
+        command_io['out'] = ResponseLog()  # values are already reduced
+        command_io['output'] = self._sample_summary(command_io, len(entries))
+        return self.check_output(command_io, test_type)
 
+    @staticmethod
+    def _sample_summary(command_io, samples):
+        '''Pin and statistics of the sampled values (`P59 mean=1020.1
+        sd=2.8 min=1016 max=1025`), or None if a value is missing.'''
+        stats = command_io['samples']
+        if stats.count < samples:
+            return None
+        return '{} mean={:.1f} sd={:.1f} min={} max={}'.format(
+            command_io['command'].split(' ')[1], stats.mean,
+            stats.standard_deviation, stats.minimum, stats.maximum)
+
+    def check_output(self, command_io, test_type):
+        '''Check and print the firmware response to a command.'''
         if test_type == 'movement':
             # Add check of encoder response
             markers = [command_io['marker'], 'R84']
@@ -223,27 +583,48 @@ class FarmduinoTestSuite(object):
             markers = [command_io['marker']]
             indent = ''
         for i, marker in enumerate(markers):
+            part = None
             # Separate motor and encoder test results
             if test_type == 'movement':
                 if i == 0:
-                    print('Motor: ', end=self.newline)
+                    part = 'Motor'
                 else:
-                    print('Encoder: ', end=self.newline)
+                    part = 'Encoder'
                     # Add encoder test to movement test count
                     self.update_test_results('count', test_type)
+                print('{}: '.format(part), end=self.newline)
 
-            if command_io['out'] != '':  # received output
+            if command_io['out']:  # received output
                 command_io = self.reduce_output(command_io, marker)
 
             # Determine test outcome and record as PASS/FAIL
             if command_io['expected'] is not None:
                 command_io = self.compare(command_io, test_type)
+                self.record_result(command_io, test_type, part)
 
             # Print sent/received and test results
             self.print_command_io(command_io, indent)
+            if (command_io['expected'] is not None
+                    and command_io['result'] == 'FAIL'):
+                self._apply_abort_rule(self._get_category(test_type))
 
+        if command_io['telemetry'] is not None and self.options['verbose']:
+            self.print_telemetry(command_io, indent)
         return command_io['output']
 
+    @staticmethod
+    def print_telemetry(command_io, indent):
+        '''Print the motion metrics of a move.'''
+        metrics = command_io['telemetry'].metrics()
+        axes = sorted(metrics) if command_io['axis'] is None else [
+            command_io['axis']]
+        for i, axis in enumerate(axes):
+            print('{}{:11}{} {velocity} steps/s, {acceleration} steps/s^2,'
+                  ' lag {lag}, max deviation {max_deviation} ({samples}'
+                  ' samples)'.format(indent, '' if i else 'TELEMETRY:',
+                                     axis, **metrics[axis]))
+        print()
+
     @staticmethod
     def get_response_marker(command):
         '''Determine the marker that will indicate the response.'''
@@ -255,64 +636,91 @@ class FarmduinoTestSuite(object):
             marker = 'R' + command[1:3]
         return marker
 
-    def get_output(self, idle=False, home=False, position=False):
-        '''Get command firmware output response.'''
-        response = ''
-        clock = 0
-        delay_increment = 0.005
-        while clock < RESPONSE_TIMEOUT:
-            time.sleep(delay_increment)
-            clock += delay_increment
-            while self.connection['serial'].in_waiting > 0:
-                response += self.connection['serial'].read()
-            if idle:
-                if 'R00' in response:
-                    # print('idle')
-                    break
-            elif home:
-                if any(zero in response
-                       for zero in ['R82 X0 Y0 Z0', 'R82 X0.00 Y0.00 Z0.00']):
-                    # print('home')
-                    break
-            elif position:
-                if 'R81' in response:  # R81 is after R85 to get full R85 output
-                    # print('encoder position report')
-                    break
-            else:
-                if 'R02' in response or 'R03' in response:
-                    # print('got response:')
-                    # print(response)
-                    break
+    @staticmethod
+    def _is_last_response(response, idle=False, home=False, position=False):
+        '''Determine if the response completes the awaited firmware output.'''
+        if idle:
+            return response.code == 'R00'
+        elif home:
+            return response.code == 'R82' and any(
+                response.fields[:3] == zero
+                for zero in [('X0', 'Y0', 'Z0'), ('X0.00', 'Y0.00', 'Z0.00')])
+        elif position:
+            # R81 is after R85 to get full R85 output
+            return response.code == 'R81'
+        return response.code in ['R02', 'R03']
+
+    def get_output(self, idle=False, home=False, position=False,
+                   telemetry=None, timeout=None, q_tag=None):
+        '''Get command firmware output response.
+
+        Position reports are added to `telemetry` (if provided), and only
+        the most recent responses are kept in the output. Waits up to
+        `timeout` seconds (RESPONSE_TIMEOUT if not provided). With a
+        `q_tag`, only the responses to the command with that queue tag are
+        used, not the periodic status reports.
+        '''
+        if telemetry is None:
+            log = ResponseLog()
         else:
-            display_warning('response timeout')
-        return response
+            log = ResponseLog(limit=TELEMETRY_SAMPLES)
+        if timeout is None:
+            timeout = RESPONSE_TIMEOUT
+            if not (idle or home or position):  # status reports take seconds
+                timeout = self.timeouts.limit(timeout)
+        deadline = time.time() + timeout
+        while True:
+            response = self.connection['reader'].read_response(
+                deadline - time.time())
+            if response is None:
+                self._response_timeout()
+                break
+            self.timeouts.observe_response(response)
+            if q_tag is not None and response.q_tag != q_tag:
+                continue
+            log.append(response)
+            if telemetry is not None:
+                telemetry.add(response)
+            if self._is_last_response(response, idle, home, position):
+                break
+        return log
 
-    @staticmethod
-    def _find_response(fw_output, marker):
-        '''Find the command response in the provided firmware output.'''
-        complete_lines = fw_output[:fw_output.rfind('\r\n')]
-        ret = complete_lines.split('\r\n')[::-1]  # sort output (last first)
-        for line in ret:
-            if marker in line:  # response to command sent
-                return line
-        return
+    def _response_timeout(self):
+        '''Warn about and count a response timeout.'''
+        display_warning('response timeout')
+        self.timing.add_timeout()
+        self.timeouts.timed_out()
+        if self.timeouts.consecutive_timeouts == UNRESPONSIVE_AFTER:
+            display_warning('board not responding: shortening waits')
 
     @staticmethod
-    def _reduce_response(response_line):
-        '''Return data from the provided command response line (`R# * Q#`).'''
-        if response_line is None:
-            return
-        return (' ').join(response_line.split(' ')[1:-1])
+    def _find_response(fw_output, marker):
+        '''Find the latest response with the marker code in the output.'''
+        response = fw_output.latest(marker)
+        if response is None:
+            return None, None
+        return response.line, response.data
 
     def reduce_output(self, command_io, marker):
         '''Add the response line and response data to the command_io object.'''
         fw_output = command_io['out']
-        command_io['received'] = self._find_response(fw_output, marker)
-        command_io['output'] = self._reduce_response(command_io['received'])
+        command_io['received'], command_io['output'] = self._find_response(
+            fw_output, marker)
         if marker == 'R84':  # include raw and scaled encoder positions
-            command_io['R85'] = self._find_response(fw_output, 'R85')
+            command_io['R85'] = self._find_response(fw_output, 'R85')[0]
+        if command_io['axis'] is not None and command_io['output']:
+            command_io['output'] = self._axis_value(
+                command_io['output'], command_io['axis'])
         return command_io
 
+    @staticmethod
+    def _axis_value(data, axis):
+        '''Select the value of one axis from position data (`X0 Y0 Z0`).'''
+        for value in data.split(' '):
+            if value.startswith(axis):
+                return value
+        return None
+
     def compare(self, command_io, test_type):
         '''Compare output to expected value.'''
         expected = command_io['expected']
@@ -320,9 +728,11 @@ class FarmduinoTestSuite(object):
         outcome = False
         if command_io['output'] is None:
             outcome = False
+        elif command_io['samples'] is not None:
+            outcome = self._statistics_comparison(expected, command_io)
         elif any(op in expected for op in ['<', '>', '=']):
             outcome = self._operator_comparison(expected, output)
-        elif all(axis in expected for axis in ['X', 'Y', 'Z']):
+        elif command_io['marker'] == 'R82':  # Position (one or all axes)
             outcome = self._delta_comparison(expected, output)
         elif command_io['marker'] == 'R83':  # Firmware version report
             if any(output == v for v in expected):
@@ -339,6 +749,33 @@ class FarmduinoTestSuite(object):
             command_io['result'] = 'FAIL'
         return command_io
 
+    def record_result(self, command_io, test_type, part=None):
+        '''Save the result of a test as a record.'''
+        name = self.test_name
+        if part is not None:
+            name = '{} {}'.format(name, part.lower())
+        expected = command_io['expected']
+        if isinstance(expected, list):
+            expected = ' or '.join(expected)
+        latency = command_io['latency']
+        if latency is not None:
+            latency = round(latency, 4)
+        self.records.append(TestRecord(
+            name, self._get_category(test_type), command_io['command'],
+            command_io['received'], command_io['output'], str(expected),
+            command_io['result'], latency, round(time.time(), 3)))
+
+    def _apply_abort_rule(self, category):
+        '''Stop the run if the category has reached its failure limit.'''
+        limit = self.abort_rules.get(category)
+        if limit is None:
+            return
+        failed = sum(1 for record in self.records
+                     if record.category == category
+                     and record.result == 'FAIL')
+        if failed >= limit:
+            raise TestsAborted('{} failed {} checks'.format(failed, category))
+
     @staticmethod
     def _operator_comparison(expected, output):
         '''Compare using provided operator (for analog pin read).'''
@@ -359,6 +796,22 @@ class FarmduinoTestSuite(object):
                 outcome = True
         return outcome
 
+    @staticmethod
+    def _statistics_comparison(expected, command_io):
+        '''Compare statistics of sampled values (for analog pin reads).'''
+        stats = command_io['samples']
+        values = {'mean': stats.mean, 'sd': stats.standard_deviation,
+                  'min': stats.minimum, 'max': stats.maximum}
+        for condition in expected.split(' ')[1:]:
+            name, operator, limit = STATISTIC_CONDITION.match(
+                condition).groups()
+            actual, limit = values[name], float(limit)
+            if ((operator == '>' and not actual > limit)
+                    or (operator == '<' and not actual < limit)
+                    or (operator == '=' and actual != limit)):
+                return False
+        return True
+
     @staticmethod
     def _delta_comparison(expected, output):
         '''Compare difference in values (for encoder readings).'''
@@ -368,12 +821,12 @@ class FarmduinoTestSuite(object):
         move_outcome = True
         move_compare_value = expected.split(' ')
         move_output_value = output.split(' ')
-        for i in range(3):
-            expect = int(move_compare_value[i][1:])
-            actual = int(float(move_output_value[i][1:]))
+        for compare_value, output_value in zip(move_compare_value,
+                                               move_output_value):
+            expect = int(compare_value[1:])
+            actual = int(float(output_value[1:]))
             difference = abs(actual - expect)
-            threshold = 5
-            if difference > threshold:
+            if difference > ENCODER_THRESHOLD:
                 move_outcome = False
         return move_outcome
 
@@ -389,8 +842,7 @@ class FarmduinoTestSuite(object):
                     print('{}{:11}{}'.format(
                         indent, 'SENT:', command_io['command']))
                 if PRINT_FIRMWARE_OUTPUT:
-                    cleaned_output = command_io['out'].replace('\r*', '*')
-                    split_output = cleaned_output.split('\r\n')
+                    split_output = command_io['out'].text().split('\r\n')
                     for i, line in enumerate(split_output):
                         title = 'OUTPUT:' if i == 0 else ''
                         end = '' if i == len(split_output) else '\n'
@@ -418,6 +870,11 @@ class FarmduinoTestSuite(object):
                 print('{}{}'.format(indent, command_io['result']))
                 sys.stdout.reset_color()
 
+    def print_test_title(self, title):
+        '''Print the title of the next test.'''
+        self.test_name = title.strip().rstrip(':')
+        print(title, end=self.newline)
+
     def skip(self, title=None):
         '''Skip test category if requested.'''
         skip_status = False
@@ -434,12 +891,24 @@ class FarmduinoTestSuite(object):
                 skip_status = True
         return skip_status
 
+    def _open_connection(self):
+        '''Open the serial port and start reading firmware output.'''
+        self.connection['serial'] = serial.Serial(
+            self.connection['port'], 115200, exclusive=True)
+        self.connection['reader'] = LineReader(self.connection['serial'])
+        self.connection['reader'].start()
+
+    def _close_connection(self):
+        '''Stop reading firmware output and close the serial port.'''
+        self.connection['reader'].stop()
+        self.connection['serial'].close()
+
     def _restart_connection(self):
         '''Restart arduino connection to clear position.'''
-        self.connection['serial'].close()
-        self.connection['serial'] = serial.Serial(
-            self.connection['port'], 115200)
-        time.sleep(2)
+        self._close_connection()
+        self._open_connection()
+        if not self._wait_for_ready():
+            display_warning('firmware not ready')
 
     def _encoder_hard_reset(self):
         '''Reset STM32.'''
@@ -451,8 +920,7 @@ class FarmduinoTestSuite(object):
     def _read_position(self):
         '''Read and print position.'''
         fw_out = self.get_output(position=True)
-        resp = self._find_response(fw_out, 'R85')
-        encoder_position = self._reduce_response(resp)
+        encoder_position = self._find_response(fw_out, 'R85')[1]
         print('raw encoder positions: {}'.format(encoder_position))
 
     def _get_board_code(self):
@@ -486,33 +954,59 @@ class FarmduinoTestSuite(object):
         '''Set firmware parameters to values for testing.'''
         if self.skip('set parameters'.upper()):
             return
-        parameters_generator = firmware_parameters.GenerateParameters()
-        parameters = parameters_generator.parameters
+        parameters = firmware_parameters.GenerateParameters().parameters
+        board_values = {}
+        if SYNC_PARAMETERS:
+            board_values = self._read_all_parameters()
+        commands = []
         for name, axes in parameters.items():
             for axis in axes:
                 parameter = axis['num']
                 value = axis['value']
-                print('{} {}: {} '.format(name, axis['axis'], value),
-                      end=self.newline)
-                self.send_command('F22 P{} V{}'.format(parameter, value))
-                self.send_command('F21 P{}'.format(parameter),
-                                  expected='P{} V{}'.format(parameter, value),
-                                  test_type='parameters')
-        self.send_command('F22 P2 V1')  # Validate parameters
+                title = '{} {}: {} '.format(name, axis['axis'], value)
+                if board_values.get(parameter) != value:
+                    commands.append({
+                        'title': title,
+                        'command': 'F22 P{} V{}'.format(parameter, value)})
+                    title = None
+                commands.append({
+                    'title': title,
+                    'command': 'F21 P{}'.format(parameter),
+                    'expected': 'P{} V{}'.format(parameter, value),
+                    'test_type': 'parameters'})
+        if board_values.get(2) != 1:
+            commands.append({'command': 'F22 P2 V1'})  # Validate parameters
         # self.send_command('F22 P3 V0')  # Don't use EEPROM
+        self.send_commands(commands)
+
+    def _read_all_parameters(self):
+        '''Get the current values of all firmware parameters.'''
+        self._clear_input()
+        self._write('F20')
+        values = {}
+        for response in self.get_output().responses:
+            if response.code == 'R21':
+                fields = dict((field[0], field[1:])
+                              for field in response.fields)
+                values[int(fields['P'])] = int(fields['V'])
+        return values
 
     @time_test
     def test_misc(self):
         '''Misc tests.'''
         if self.skip(title='Preliminary tests:'.upper()):
             return
-        print('Return firmware version: ', end=self.newline)
+        self.print_test_title('Return firmware version: ')
         if not self.skip():
-            self.board_info['firmware'] = self.send_command(
-                'F83', expected=self.board_info['expected_versions'])
+            try:
+                self.board_info['firmware'] = self.send_command(
+                    'F83', expected=self.board_info['expected_versions'])
+            except TestsAborted:  # keep the wrong version for the results
+                self.board_info['firmware'] = self.records[-1].values
+                raise
             if USE_STM32_RESET and 'G' in self._get_board_code():
                 self._encoder_hard_reset()
-        print('Return current position: ', end=self.newline)
+        self.print_test_title('Return current position: ')
         if not self.skip():
             self.send_command('F82', expected='X0 Y0 Z0')
 
@@ -521,7 +1015,10 @@ class FarmduinoTestSuite(object):
         '''Movement tests.'''
         if self.skip(title='Movement tests:'.upper()):
             return
-        steps = 200
+        if COMBINED_MOVEMENT:
+            self._test_combined_movement()
+            return
+        steps = MOVEMENT_STEPS
         axes = ['X', 'Y', 'Z']
         for axis_num, axis in enumerate(axes):
             for direction in [1, -1]:
@@ -529,8 +1026,9 @@ class FarmduinoTestSuite(object):
                     text_direction = 'forward'
                 else:
                     text_direction = 'backward'
+                self.test_name = 'Move {} axis {}'.format(axis, text_direction)
                 sys.stdout.bold()
-                print('Move {} axis {}:'.format(axis, text_direction))
+                print('{}:'.format(self.test_name))
                 sys.stdout.reset_color()
                 if self.skip():
                     continue
@@ -543,61 +1041,102 @@ class FarmduinoTestSuite(object):
                 if '{}{}'.format(axis, direction) == 'Z-1':
                     self._reset_position()  # post-test reset
 
+    def _test_combined_movement(self):
+        '''Move all axes forward and backward together from home, checking
+        each axis.'''
+        for target, text_direction in [(MOVEMENT_STEPS, 'forward'),
+                                       (-MOVEMENT_STEPS, 'backward')]:
+            sys.stdout.bold()
+            print('Move all axes {}:'.format(text_direction))
+            sys.stdout.reset_color()
+            if self.skip():
+                continue
+            self._reset_position()
+            self.test_name = 'Move all axes {}'.format(text_direction)
+            command_io = self._new_command_io(
+                'G00 X{0} Y{0} Z{0}'.format(target), None, 'movement')
+            self._transmit(command_io)
+            for axis in ['X', 'Y', 'Z']:
+                self.test_name = 'Move {} axis {}'.format(axis, text_direction)
+                print('{}:'.format(self.test_name))
+                axis_io = dict(command_io, axis=axis,
+                               expected='{}{}'.format(axis, target))
+                self.update_test_results('count', 'movement')
+                self.check_output(axis_io, 'movement')
+        self._reset_position()  # post-test reset
+
     @time_test
-    def test_pins(self):
-        '''Pin tests.'''
-        def read_pin(pin, value, mode):
-            '''Send a read pin message.'''
-            self.send_command('F42 P{} M{}'.format(pin, mode),
-                              expected='P{} V{}'.format(pin, value),
-                              test_type='pins')
+    def test_pins(self, pins=None, crosstalk=None):
+        '''Pin tests (peripheral pins of the board by default).'''
         if self.skip(title='Pin tests:'.upper()):
             return
         mode = 0
-        if self.board_info['board'] == 'RAMPS':
+        if pins is None and self.board_info['board'] == 'RAMPS':
             pins = RAMPS_PERIPHERAL_PINS
-        else:
+        elif pins is None:
             pins = FARMDUINO_PERIPHERAL_PINS
+        if self.history:  # read the pins that failed most often first
+            pins = sorted(pins, key=lambda pin: -self.history['pins'].get(
+                pin, 0))
+        if crosstalk is None:
+            crosstalk = CROSSTALK_PIN_TESTS
+        if BATCH_PIN_TESTS or crosstalk:
+            self._test_pin_patterns(pins, crosstalk)
+            pins = []
         for pin in pins:
             for value in [1, 0]:
                 if value > 0:
                     text_value = 'on'
                 else:
                     text_value = 'off'
-                print('Turn pin {} {}: '.format(pin, text_value),
-                      end=self.newline)
+                self.print_test_title(
+                    'Turn pin {} {}: '.format(pin, text_value))
                 if self.skip():
                     continue
                 self.send_command('F41 P{} V{} M0'.format(pin, value))
-                read_pin(pin, value, mode)
-        # Read-only pins
-        read_pins = [
-            {'description': 'soil sensor',
-             'number': SOIL_PIN, 'mode': 1,
-             'expected_value': EXPECTED_SOIL_SENSOR_VALUE},
-            {'description': 'tool verification (connect to ground)',
-             'number': TOOL_PIN, 'mode': 0,
-             'expected_value': EXPECTED_TOOL_VERIFICATION_PIN_VALUE}
-            ]
-        for pin in read_pins:
-            mode_text = {'0': 'digital', '1': 'analog'}[str(pin['mode'])]
-            print('Read pin {} - {} - {} read mode: '.format(
-                pin['number'], pin['description'], mode_text),
-                  end=self.newline)
-            if not self.skip():
-                read_pin(pin['number'], pin['expected_value'], pin['mode'])
+                self.send_command('F42 P{} M{}'.format(pin, mode),
+                                  expected='P{} V{}'.format(pin, value),
+                                  test_type='pins')
+
+    def _test_pin_patterns(self, pins, crosstalk):
+        '''Write each on/off pattern to all pins and read each pin back, in
+        one pipelined burst.'''
+        text_values = {0: 'off', 1: 'on'}
+        commands = []
+        for number, pattern in enumerate(pin_patterns(len(pins), crosstalk),
+                                         1):
+            title = 'Turn pin {} {}: '
+            if crosstalk:
+                title = 'Pattern {} pin {{}} {{}}: '.format(number)
+            commands.extend({'command': 'F41 P{} V{} M0'.format(pin, value)}
+                            for pin, value in zip(pins, pattern))
+            commands.extend({
+                'command': 'F42 P{} M0'.format(pin),
+                'title': title.format(pin, text_values[value]),
+                'expected': 'P{} V{}'.format(pin, value),
+                'test_type': 'pins'} for pin, value in zip(pins, pattern))
+        sys.stdout.bold()
+        print('Pins {}: {}'.format(
+            ' '.join(str(pin) for pin in pins),
+            'cross-talk patterns' if crosstalk else 'on, then off'))
+        sys.stdout.reset_color()
+        if self.skip():
+            return
+        self.send_commands(commands)
+
+    @staticmethod
+    def _get_category(test_type):
+        '''Get the results category of a test type.'''
+        for category in ['movement', 'pins', 'parameters']:
+            if category in test_type:
+                return category
+        return 'misc'
 
     def update_test_results(self, result_category, test_category):
         '''Update the test results summary.'''
         self.test_results['total'][result_category] += 1
-        if 'movement' in test_category:
-            self.test_results['movement'][result_category] += 1
-        elif 'pins' in test_category:
-            self.test_results['pins'][result_category] += 1
-        elif 'parameters' in test_category:
-            self.test_results['parameters'][result_category] += 1
-        else:
-            self.test_results['misc'][result_category] += 1
+        category = self._get_category(test_category)
+        self.test_results[category][result_category] += 1
 
     def print_results(self):
         '''Print number of passing tests.'''
@@ -611,6 +1150,10 @@ class FarmduinoTestSuite(object):
                   fw_title='FIRMWARE:', fw=self.board_info['firmware'],
                   date_title='TEST DATE:',
                   date=time.strftime('%Y-%m-%d %H:%m', time.gmtime())))
+        if self.aborted is not None:
+            sys.stdout.change_color('red')
+            print('{:11}{}\n{}'.format('ABORTED:', self.aborted, '=' * 50))
+            sys.stdout.reset_color()
         print('{:12}{:8}{:9}{:10}{:12}'.format(
             'CATEGORY', 'PASS', 'COUNT', 'PERCENT', 'TIME (sec)'))
         for cat in ['total', 'misc', 'movement', 'pins', 'parameters']:
@@ -623,40 +1166,204 @@ class FarmduinoTestSuite(object):
                 percent = 0
             print('{:12}{:3}{:8}{:10}%{:12}'.format(
                 cat, passed, count, percent, elapsed))
-        print('{line}\n'.format(line='=' * 50))
+        print('{line}'.format(line='=' * 50))
+        if not self.replaying:  # replay does not wait for responses
+            self.print_timing()
+            print('{line}'.format(line='=' * 50))
+        print()
+
+    def print_timing(self):
+        '''Print the latency breakdown of each command code (ms).'''
+        def milliseconds(value):
+            '''Format a duration for the timing table.'''
+            return '-' if value is None else '{:.1f}'.format(value)
+        print('{:12}{:>6}{:>8}{:>10}{:>9}{:>9}'.format(
+            'COMMAND', 'COUNT', 'LINK', 'FIRMWARE', 'TOTAL', 'MAX (ms)'))
+        for code, summary in sorted(self.timing.breakdown().items()):
+            print('{:12}{:>6}{:>8}{:>10}{:>9}{:>9}'.format(
+                code, summary['count'], milliseconds(summary['link']),
+                milliseconds(summary['firmware']),
+                milliseconds(summary['total']), milliseconds(summary['max'])))
+        print('Response timeouts: {}'.format(self.timing.timeouts))
+        print('Slowest commands:')
+        for timing in self.timing.slowest(SLOWEST_COMMANDS):
+            print('  {:30}{:>10} ms'.format(
+                timing.command, milliseconds(timing.phases()['total'] * 1000)))
+
+    def _get_run_info(self):
+        '''Board, firmware, and summary of the test run.'''
+        return {'board': self.board_info['board'],
+                'firmware': self.board_info['firmware'],
+                'port': self.connection['port'],
+                'date': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+                'summary': self.test_results,
+                'telemetry': self.move_metrics,
+                'aborted': self.aborted,
+                'timing': {'timeouts': self.timing.timeouts,
+                           'commands': self.timing.breakdown()}}
+
+    def export_results(self):
+        '''Save the test records in machine-readable formats.'''
+        if not EXPORT_FORMATS:
+            return
+        results_file = self.results_file.format(board=self.board_info['board'])
+        filenames = export_records(os.path.splitext(results_file)[0],
+                                   self.records, self._get_run_info(),
+                                   EXPORT_FORMATS)
+        print('Results exported to {}'.format(', '.join(filenames)))
+        print()
+
+    def save_history(self):
+        '''Add the test run to the results database.'''
+        if not SAVE_HISTORY:
+            return
+        store = ResultsStore()
+        store.save_run(self._get_run_info(), self.records)
+        store.close()
 
     def run(self, auto_run=False):
         '''Run test suite.'''
         # Begin copying stdout for saving to file
-        sys.stdout = self.copy_stdout = CarbonCopy()
+        if self.copy_stdout is None:
+            sys.stdout = self.copy_stdout = CarbonCopy()
 
         # Print header
         print('{line}{header}{line}'.format(line='=' * 50, header=HEADER))
 
-        self.select_board(auto_run)
+        self.status = 'connecting'
+        detected_board = self.detect_board(auto_run)
+        self.select_board(auto_run, board=detected_board or FARMDUINO)
+        self.copy_stdout.open_file(
+            self.results_file.format(board=self.board_info['board']))
         self.connect_to_board(auto_run)
         self.prompt_for_run_mode(auto_run)
 
-        suite_start_time = time.time()
-
-        self.test_results['parameters']['time'] = self.write_parameters()
-        self.test_results['misc']['time'] = self.test_misc()
-        self.test_results['movement']['time'] = self.test_movement()
-        self.test_results['pins']['time'] = self.test_pins()
-
-        self.test_results['total']['time'] = time_elapsed(
-            suite_start_time, time.time())
+        plan = load_plan(self.plan_file)
+        if HISTORY_ORDERING:
+            self.history = self.load_history()
+        if self.record_file is not None:
+            self.start_recording(plan)
+        self.run_tests(plan)
         self.print_results()
+        self.export_results()
+        self.save_history()
 
         self.exit(auto_run)
 
         # Save a copy of the output to file
         self.copy_stdout.save_copy_to_file(
-            '{}_board-test-results.txt'.format(self.board_info['board']))
+            self.results_file.format(board=self.board_info['board']))
+
+    def load_history(self):
+        '''Failure rates of earlier runs of the board type (None if there
+        is no results database).'''
+        if not os.path.exists(RESULTS_DATABASE):
+            return None
+        store = ResultsStore()
+        history = store.failure_rates(board=self.board_info['board'])
+        store.close()
+        return history
+
+    def run_tests(self, plan):
+        '''Compile and run a test plan, timing the categories.'''
+        suite_start_time = time.time()
+
+        if self.fail_fast and self.run_mode == '3':
+            self.abort_rules = plan.get('fail_fast', {})
+        priorities = None
+        if self.history:
+            priorities = history_priorities(plan, self.history['categories'])
+        schedule = compile_plan(plan, self.board_info['board'], priorities)
+        for category, elapsed in self.run_plan(schedule).items():
+            self.test_results[category]['time'] = round(elapsed, 2)
+
+        self.test_results['total']['time'] = time_elapsed(
+            suite_start_time, time.time())
+        self.status = 'done' if self.aborted is None else 'aborted'
+
+    def start_recording(self, plan):
+        '''Save the serial data of the tests to the record file.'''
+        self.recorder = open_recorder(self.record_file, {
+            'board': self.board_info['board'],
+            'port': self.connection['port'], 'plan': plan,
+            'fail_fast': self.fail_fast, 'history': self.history})
+        self.connection['reader'].recorder = self.recorder
+
+    def stop_recording(self):
+        '''Finish the serial transcript.'''
+        if self.recorder is not None:
+            self.connection['reader'].recorder = None
+            self.recorder.close()
+            self.recorder = None
+            print('Serial transcript saved to {}'.format(self.record_file))
+
+    def replay(self, filename):
+        '''Run the tests against a recorded serial transcript (no board).'''
+        if self.copy_stdout is None:
+            sys.stdout = self.copy_stdout = CarbonCopy(copy=False)
+        header, events = load_transcript(filename)
+        if header.get('plan') is None:  # converted from a results file
+            display_warning('transcript cannot be replayed')
+            print('{} has no test plan or timestamps.'.format(filename))
+            return None
+        print('Replaying {} ({} board, recorded {} UTC)'.format(
+            filename, header['board'], time.strftime(
+                '%Y-%m-%d %H:%M', time.gmtime(header['started']))))
+        board = [code for code, info in BOARDS.items()
+                 if info['name'] == header['board']][0]
+        self.select_board(auto_run=True, board=board)
+        self.connection['port'] = header['port']
+        self.connection['serial'] = self.connection['reader'] = (
+            TranscriptReplay(events))
+        self.replaying = True
+        self.fail_fast = header.get('fail_fast', False)
+        self.history = header.get('history')
+        if self.history:  # JSON object keys are strings
+            self.history['pins'] = dict(
+                (int(pin), rate) for pin, rate in self.history['pins'].items())
+        self.prompt_for_run_mode(auto_run=True)
+        self.run_tests(header['plan'])
+        self.print_results()
+        mismatches = self.connection['serial'].mismatches
+        if mismatches:
+            display_warning('{} commands differ from the recording'.format(
+                len(mismatches)))
+            print('First: {}'.format(mismatches[0]))
+        return self.test_results
+
+    def run_plan(self, schedule):
+        '''Run a compiled test plan. Return the time spent per category.'''
+        times = dict.fromkeys(CATEGORIES, 0)
+        for kind, steps in schedule:
+            self.status = steps[0].get('category', 'misc')
+            start_time = time.time()
+            commands = [dict(command, test_type=step.get('category', 'misc'))
+                        for step in steps for command in step.get(
+                            'commands', [])]
+            try:
+                if kind == 'run':
+                    getattr(self, steps[0]['run'])(
+                        **steps[0].get('arguments', {}))
+                elif not self.skip(title=', '.join(
+                        step['name'] for step in steps).upper()):
+                    self.send_commands(commands)
+            except TestsAborted as error:
+                self.aborted = str(error)
+                display_warning('aborted: {}'.format(self.aborted))
+            elapsed = time.time() - start_time
+            if kind == 'run':
+                times[self.status] += elapsed
+            for command in commands:  # split time by number of commands
+                times[command['test_type']] += elapsed / len(commands)
+            if self.aborted is not None:
+                break
+        return times
 
     def exit(self, auto_run=False):
         '''Close serial and quit.'''
-        self.connection['serial'].close()
+        self.stop_recording()
+        if not self.keep_connection:
+            self._close_connection()
         if auto_run:
             notes = 'Automated run.'
         else:
@@ -668,37 +1375,63 @@ class FarmduinoTestSuite(object):
 
 
 class CarbonCopy(object):
-    '''Copy STDOUT to string.'''
-    def __init__(self):
-        self.stdout = sys.stdout
-        self.string = ''
+    '''Copy STDOUT to files (or other outputs) as it is written.'''
+    def __init__(self, stdout=None, copy=True):
+        self.stdout = sys.stdout if stdout is None else stdout
+        self.codes = terminal_codes(self.stdout)
+        self.outputs = []
+        self.pending = [] if copy else None  # held until an output is added
+        self.copy_file = None
+        self.last_flush = time.time()
 
     def write(self, text):
-        '''Write to stdout and append a copy to a string.'''
+        '''Write to stdout and copy to the other outputs.'''
         self.stdout.write(text)
-        self.string += text
-
-    def _write_color_code(self, args):
-        '''Safely write color code.'''
-        try:
-            code = subprocess.check_output(args)
-        except subprocess.CalledProcessError:
-            pass
-        else:
-            self.stdout.write(code)
+        self._copy(text)
+
+    def _copy(self, text):
+        '''Write to the copy outputs, flushing them periodically.'''
+        if self.pending is not None:
+            self.pending.append(text)
+        for output in self.outputs:
+            output.write(text)
+        if self.outputs and time.time() - self.last_flush > FLUSH_INTERVAL:
+            self.flush_copies()
+
+    def add_output(self, output):
+        '''Copy output to a stream (including output held until now).'''
+        if self.pending is not None:
+            output.write(''.join(self.pending))
+            self.pending = None
+        self.outputs.append(output)
+
+    def open_file(self, filename):
+        '''Save the stdout copy to a file while it is written.'''
+        self.copy_file = open(filename, 'w')
+        self.add_output(self.copy_file)
+
+    def flush_copies(self):
+        '''Flush the copy outputs.'''
+        for output in self.outputs:
+            output.flush()
+        self.last_flush = time.time()
+
+    def _write_color_code(self, name):
+        '''Write a color code (if output is to a terminal).'''
+        if self.codes[name]:
+            self.stdout.write(self.codes[name])
 
     def change_color(self, color):
         '''Change color of terminal output.'''
-        c_num = {'red': '1', 'green': '2'}
-        self._write_color_code(['tput', 'setaf', c_num[color]])
+        self._write_color_code(color)
 
     def bold(self):
         '''Make output bold.'''
-        self._write_color_code(['tput', 'bold'])
+        self._write_color_code('bold')
 
     def reset_color(self):
         '''Reset color of terminal output.'''
-        self._write_color_code(['tput', 'sgr0'])
+        self._write_color_code('reset')
 
     def flush(self):
         '''Flush.'''
@@ -706,16 +1439,37 @@ class CarbonCopy(object):
 
     def append_newline(self):
         '''Add an extra newline for use after input prompts.'''
-        self.string += '\n'
+        self._copy('\n')
 
     def save_copy_to_file(self, filename):
-        '''Save the stdout copy to a file.'''
-        with open(filename, 'w') as copy_file:
-            copy_file.write(self.string)
+        '''Finish saving the stdout copy to a file.'''
+        if self.copy_file is None:
+            self.open_file(filename)
+        self.outputs.remove(self.copy_file)
+        self.copy_file.close()
+        if self.copy_file.name != filename:
+            os.rename(self.copy_file.name, filename)
+        self.copy_file = None
 
 if __name__ == '__main__':
     FTS = FarmduinoTestSuite()
-    if len(sys.argv) == 1:
+    ARGUMENTS = sys.argv[1:]
+    if '--fail-fast' in ARGUMENTS:
+        ARGUMENTS.remove('--fail-fast')
+        FTS.fail_fast = True
+    for OPTION, ATTRIBUTE in [('--plan', 'plan_file'),
+                              ('--record', 'record_file')]:
+        if OPTION in ARGUMENTS[:-1]:
+            setattr(FTS, ATTRIBUTE,
+                    ARGUMENTS.pop(ARGUMENTS.index(OPTION) + 1))
+            ARGUMENTS.remove(OPTION)
+    if not ARGUMENTS:
         FTS.run()
-    elif sys.argv[1] == 'auto':
+    elif ARGUMENTS[0] == 'auto':
         FTS.run(auto_run=True)
+    elif ARGUMENTS[0] == 'replay':
+        sys.stdout = CarbonCopy(copy=False)
+        for TRANSCRIPT in ARGUMENTS[1:]:
+            REPLAY = FarmduinoTestSuite()
+            REPLAY.copy_stdout = sys.stdout
+            REPLAY.replay(TRANSCRIPT)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+'''Read line-framed firmware output from a serial connection.'''
+
+from __future__ import print_function
+import threading
+import time
+from collections import deque, namedtuple
+import serial
+
+LINE_ENDING = '\r\n'
+READ_TIMEOUT = 0.05  # seconds, reader thread shutdown check interval
+
+
+class Response(namedtuple(
+        'Response', ['code', 'fields', 'q_tag', 'timestamp', 'line'])):
+    '''A firmware response line (`R## [field ...] Q#`).'''
+    __slots__ = ()
+
+    @property
+    def data(self):
+        '''Response fields as a string (`X0 Y0 Z0`).'''
+        return ' '.join(self.fields)
+
+
+def parse_response(line, timestamp=None):
+    '''Split a firmware response line into code, fields, and queue tag.'''
+    parts = line.split(' ')
+    q_tag = None
+    if len(parts) > 1 and parts[-1].startswith('Q'):
+        q_tag = parts.pop()[1:]
+    return Response(parts[0], tuple(parts[1:]), q_tag, timestamp, line)
+
+
+def is_ready_response(response):
+    '''Determine if the response shows the firmware is ready for commands.'''
+    return response.code == 'R00' or (
+        response.code == 'R99' and 'STARTUP COMPLETE' in response.line)
+
+
+class ResponseLog(object):
+    '''Firmware responses to a command, indexed by response code.
+
+    With a `limit`, only the most recent responses are kept (and the latest
+    response for each code).
+    '''
+
+    def __init__(self, limit=None):
+        self.responses = deque(maxlen=limit)
+        self.index = {}
+        self.first = None
+
+    def append(self, response):
+        '''Add a response and make it the latest one for its code.'''
+        if self.first is None:
+            self.first = response
+        self.responses.append(response)
+        self.index[response.code] = response
+
+    def latest(self, code):
+        '''Most recent response with the provided code (or None).'''
+        return self.index.get(code)
+
+    def text(self):
+        '''Response lines as received.'''
+        return ''.join(response.line + LINE_ENDING
+                       for response in self.responses)
+
+    def __len__(self):
+        '''Number of responses.'''
+        return len(self.responses)
+
+
+class LineReader(object):
+    '''Split firmware output into parsed responses in a background thread.'''
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.responses = deque()
+        self.partial = ''
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.recorder = None  # transcript recorder of reads, clears, timeouts
+
+    def start(self):
+        '''Begin reading from the serial connection.'''
+        self.connection.timeout = READ_TIMEOUT
+        self.running = True
+        self.thread = threading.Thread(target=self._read_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        '''Stop reading and wait for the reader thread to exit.'''
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _read_loop(self):
+        '''Read all available bytes at once and queue complete lines.'''
+        while self.running:
+            try:
+                data = self.connection.read(
+                    max(1, self.connection.in_waiting))
+            except (serial.SerialException, OSError, TypeError):
+                break  # connection closed
+            if data:
+                timestamp = time.time()
+                with self.condition:  # record in the order lines are seen
+                    if self.recorder is not None:
+                        self.recorder.received(timestamp, data)
+                    self._add_data(data.decode('ascii', 'replace'), timestamp)
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def _add_data(self, text, timestamp):
+        '''Queue the complete lines in the provided text.'''
+        lines = (self.partial + text).split(LINE_ENDING)
+        self.partial = lines.pop()
+        if lines:
+            with self.condition:
+                self.responses.extend(
+                    parse_response(line, timestamp) for line in lines)
+                self.condition.notify_all()
+
+    def clear(self):
+        '''Discard queued responses. Return the discarded responses.'''
+        with self.condition:
+            if self.recorder is not None:
+                self.recorder.cleared(time.time())
+            discarded = list(self.responses)
+            self.responses.clear()
+        return discarded
+
+    def read_response(self, timeout):
+        '''Return the next response, or None if none arrives in time.'''
+        deadline = time.time() + timeout
+        with self.condition:
+            while not self.responses:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.running:
+                    if self.recorder is not None:
+                        self.recorder.timed_out(time.time())
+                    return None
+                self.condition.wait(remaining)
+            return self.responses.popleft()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+'''Simulate farmbot-arduino-firmware on a pseudo-terminal (POSIX only).'''
+
+from __future__ import print_function
+import argparse
+import errno
+import fcntl
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+FIRMWARE_VERSION = '6.4.0'
+BOOT_MESSAGES = ['R99 ARDUINO STARTUP COMPLETE']
+INPUT_PINS = {63: 1}  # tool verification pin connected to ground
+ANALOG_PINS = {59: 1020}  # soil sensor
+# Used for movement until the parameters are written.
+DEFAULT_PARAMETERS = {
+    41: 300, 42: 300, 43: 300,  # acceleration (steps)
+    61: 50, 62: 50, 63: 50,  # min speed (steps/s)
+    71: 400, 72: 400, 73: 400,  # max speed (steps/s)
+    115: 5556, 116: 5556, 117: 5556,  # encoder scaling
+    }
+MOVE_STEP = 0.01  # seconds of simulated time per movement update
+MOVE_REPORT_INTERVAL = 0.1  # seconds between position reports during moves
+WRITE_TIMEOUT = 0.1  # seconds before output is dropped (nobody reading)
+
+
+class FirmwareSimulator(object):
+    '''Respond to F/G commands like a board running the test firmware.'''
+
+    def __init__(self, board='F', latency=0.0, jitter=0.0, time_scale=1.0,
+                 report_interval=0.5, faults=None, seed=None):
+        self.settings = {
+            'board': board,  # firmware version suffix: R, F, or G
+            'latency': latency,  # seconds before each command reply
+            'jitter': jitter,  # maximum random latency variation (seconds)
+            'time_scale': float(time_scale),  # >1 to run faster than real
+            'report_interval': report_interval,  # idle report period (sec)
+            }
+        self.faults = {
+            'drop': 0.0,  # probability a command receives no reply
+            'error': 0.0,  # probability a command is rejected (R03)
+            'encoder_error': [0, 0, 0],  # encoder offset from motor (steps)
+            'stuck_pins': {},  # pin: value always read
+            'crosstalk': {},  # pin: other pin that reads on when it is on
+            'analog_noise': 3,  # analog read standard deviation
+            }
+        self.faults.update(faults or {})
+        self.random = random.Random(seed)
+        self.state = {'parameters': dict(DEFAULT_PARAMETERS), 'pins': {},
+                      'position': [0.0, 0.0, 0.0]}
+        self.handlers = {
+            'F20': self._list_parameters, 'F21': self._read_parameter,
+            'F22': self._write_parameter, 'F41': self._write_pin,
+            'F42': self._read_pin, 'F43': self._set_pin_mode,
+            'F81': self._report_endstops, 'F82': self._report_position,
+            'F83': self._report_version, 'F84': self._set_home,
+            'G00': self._move,
+            }
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        fcntl.fcntl(self.master, fcntl.F_SETFL,
+                    fcntl.fcntl(self.master, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.port = os.ttyname(self.slave)
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        '''Boot the simulated firmware.'''
+        self.running = True
+        self.thread = threading.Thread(target=self._loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        '''Shut down the simulated firmware and close the pseudo-terminal.'''
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        os.close(self.master)
+        os.close(self.slave)
+
+    def _sleep(self, seconds):
+        '''Wait for the provided amount of simulated time.'''
+        if seconds > 0:
+            time.sleep(seconds / self.settings['time_scale'])
+
+    def _send(self, line, q_tag='0'):
+        '''Write a response line with a queue tag.'''
+        data = '{} Q{}\r\n'.format(line, q_tag).encode()
+        deadline = time.time() + WRITE_TIMEOUT
+        while data and time.time() < deadline:
+            try:
+                data = data[os.write(self.master, data):]
+            except OSError as error:
+                if error.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                select.select([], [self.master], [], WRITE_TIMEOUT)
+
+    def _loop(self):
+        '''Execute received commands and send idle reports.'''
+        for message in BOOT_MESSAGES:
+            self._send(message)
+        received = ''
+        next_report = time.time()
+        while self.running:
+            wait = max(0, min(next_report - time.time(), 0.1))
+            readable = select.select([self.master], [], [], wait)[0]
+            if readable:
+                received += os.read(self.master, 1024).decode(
+                    'ascii', 'replace')
+                while '\n' in received:
+                    line, received = received.split('\n', 1)
+                    if line.strip():
+                        self.execute(line.strip())
+            if time.time() >= next_report:
+                self._report_status()
+                next_report = time.time() + (
+                    self.settings['report_interval']
+                    / self.settings['time_scale'])
+
+    @staticmethod
+    def parse_command(line):
+        '''Split a command into code, arguments, and queue tag.'''
+        parts = line.split()
+        arguments = {}
+        for part in parts[1:]:
+            arguments[part[0]] = part[1:]
+        q_tag = arguments.pop('Q', '0')
+        return parts[0], arguments, q_tag
+
+    def execute(self, line):
+        '''Respond to a command.'''
+        code, arguments, q_tag = self.parse_command(line)
+        if self.random.random() < self.faults['drop']:
+            return
+        self._sleep(self.settings['latency'] + self.random.uniform(
+            -self.settings['jitter'], self.settings['jitter']))
+        handler = self.handlers.get(code)
+        if handler is None or self.random.random() < self.faults['error']:
+            self._send('R03', q_tag)
+            return
+        self._send('R01', q_tag)
+        for response in handler(arguments, q_tag) or []:
+            self._send(response, q_tag)
+        self._send('R02', q_tag)
+        if code == 'F84':
+            self._report_status()
+
+    def _parameter(self, number):
+        '''Current value of a parameter.'''
+        return self.state['parameters'].get(number, 0)
+
+    def _list_parameters(self, _arguments, _q_tag):
+        '''F20: report all parameters.'''
+        return ['R21 P{} V{}'.format(number, value) for number, value
+                in sorted(self.state['parameters'].items())]
+
+    def _read_parameter(self, arguments, _q_tag):
+        '''F21: report a parameter value.'''
+        number = int(arguments['P'])
+        return ['R21 P{} V{}'.format(number, self._parameter(number))]
+
+    def _write_parameter(self, arguments, _q_tag):
+        '''F22: store a parameter value.'''
+        self.state['parameters'][int(arguments['P'])] = int(arguments['V'])
+
+    def _write_pin(self, arguments, _q_tag):
+        '''F41: set a pin value.'''
+        self.state['pins'][int(arguments['P'])] = int(arguments['V'])
+
+    def _read_pin(self, arguments, _q_tag):
+        '''F42: report a pin value.'''
+        pin, mode = int(arguments['P']), arguments.get('M', '0')
+        if pin in self.faults['stuck_pins']:
+            value = self.faults['stuck_pins'][pin]
+        elif mode == '1' and pin in ANALOG_PINS:
+            value = int(round(self.random.gauss(
+                ANALOG_PINS[pin], self.faults['analog_noise'])))
+        elif pin in INPUT_PINS:
+            value = INPUT_PINS[pin]
+        else:
+            value = self.state['pins'].get(pin, 0)
+            for source, target in self.faults['crosstalk'].items():
+                if target == pin and self.state['pins'].get(source):
+                    value = 1
+        return ['R41 P{} V{}'.format(pin, value)]
+
+    @staticmethod
+    def _set_pin_mode(_arguments, _q_tag):
+        '''F43: set a pin mode.'''
+        return
+
+    @staticmethod
+    def _report_endstops(_arguments=None, _q_tag=None):
+        '''F81: report endstop states.'''
+        return ['R81 XA0 XB0 YA0 YB0 ZA0 ZB0']
+
+    def _position_reports(self):
+        '''Motor (R82), scaled encoder (R84), and raw encoder (R85) lines.'''
+        motor = [int(round(value)) for value in self.state['position']]
+        encoder = [value + error for value, error
+                   in zip(self.state['position'],
+                          self.faults['encoder_error'])]
+        raw = [int(round(value * 10000. / (self._parameter(115 + i) or 1)))
+               for i, value in enumerate(encoder)]
+        return ['R82 X{} Y{} Z{}'.format(*motor),
+                'R84 X{:.2f} Y{:.2f} Z{:.2f}'.format(*encoder),
+                'R85 X{} Y{} Z{}'.format(*raw)]
+
+    def _report_position(self, _arguments, _q_tag):
+        '''F82: report the current position.'''
+        return self._position_reports()[:1]
+
+    def _report_version(self, _arguments, _q_tag):
+        '''F83: report the firmware version.'''
+        return ['R83 {}.{}'.format(FIRMWARE_VERSION, self.settings['board'])]
+
+    def _set_home(self, arguments, _q_tag):
+        '''F84: set the current position of the selected axes to zero.'''
+        for i, axis in enumerate('XYZ'):
+            if arguments.get(axis) == '1':
+                self.state['position'][i] = 0.0
+
+    def _report_status(self):
+        '''Send the periodic position, endstop, and idle reports.'''
+        for line in self._position_reports() + self._report_endstops():
+            self._send(line)
+        self._send('R00')
+
+    def _axis_speed(self, axis, traveled, remaining):
+        '''Axis speed (steps/s) with linear acceleration and deceleration.'''
+        acceleration = self._parameter(41 + axis) or 1
+        min_speed = self._parameter(61 + axis) or 1
+        max_speed = max(self._parameter(71 + axis), min_speed)
+        ramp = min(1.0, min(traveled, remaining) / float(acceleration))
+        return min_speed + (max_speed - min_speed) * ramp
+
+    def _move(self, arguments, q_tag):
+        '''G00: move to the target position, reporting progress.'''
+        target = [float(arguments.get(axis, 0)) for axis in 'XYZ']
+        start = list(self.state['position'])
+        last_report = 0.0
+        elapsed = 0.0
+        while self.state['position'] != target:
+            for axis in range(3):
+                position = self.state['position'][axis]
+                distance = target[axis] - position
+                if distance == 0:
+                    continue
+                speed = self._axis_speed(
+                    axis, abs(position - start[axis]), abs(distance))
+                step = min(abs(distance), speed * MOVE_STEP)
+                self.state['position'][axis] += step if distance > 0 else -step
+            self._sleep(MOVE_STEP)
+            elapsed += MOVE_STEP
+            if elapsed - last_report >= MOVE_REPORT_INTERVAL:
+                last_report = elapsed
+                self._send('R04', q_tag)
+                for line in self._position_reports():
+                    self._send(line, q_tag)
+        return self._position_reports()
+
+
+def main():
+    '''Run a simulated board until interrupted.'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--board', choices=['R', 'F', 'G'], default='F',
+                        help='firmware version suffix (board type)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds before each command reply')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='maximum random latency variation (seconds)')
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help='run movement and reports faster than real time')
+    parser.add_argument('--drop', type=float, default=0.0,
+                        help='probability a command receives no reply')
+    parser.add_argument('--error', type=float, default=0.0,
+                        help='probability a command is rejected')
+    parser.add_argument('--encoder-error', type=int, nargs=3,
+                        default=[0, 0, 0], metavar=('X', 'Y', 'Z'),
+                        help='encoder offset from motor position (steps)')
+    args = parser.parse_args()
+    simulator = FirmwareSimulator(
+        board=args.board, latency=args.latency, jitter=args.jitter,
+        time_scale=args.time_scale,
+        faults={'drop': args.drop, 'error': args.error,
+                'encoder_error': args.encoder_error})
+    simulator.start()
+    print('Simulated board available at {}'.format(simulator.port))
+    print('Press <Ctrl+C> to exit...')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print()
+    simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
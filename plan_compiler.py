@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+'''Load test plans and compile them into a schedule for a board.'''
+
+from __future__ import print_function
+import json
+import os
+import re
+import sys
+
+PLAN_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'plans')
+DEFAULT_PLAN = os.path.join(PLAN_DIRECTORY, 'default.json')
+ACTIONS = ['write_parameters', 'test_misc', 'test_movement', 'test_pins']
+CATEGORIES = ['parameters', 'misc', 'movement', 'pins']
+# Expected statistic of a sampled read, for example `mean>1000` or `sd<20`
+STATISTIC_CONDITION = re.compile(r'^(mean|sd|min|max)([<>=])(-?\d+\.?\d*)$')
+
+
+class PlanError(ValueError):
+    '''The test plan is not valid.'''
+
+
+def load_plan(filename=None):
+    '''Read and validate a test plan file (the default plan if None).'''
+    with open(filename or DEFAULT_PLAN) as plan_file:
+        plan = json.load(plan_file)
+    validate_plan(plan)
+    return plan
+
+
+def validate_plan(plan):
+    '''Check step names, actions, categories, sampled reads, dependencies,
+    and fail-fast rules.'''
+    names = set()
+    for step in plan['steps']:
+        name = step.get('name')
+        if name is None or name in names:
+            raise PlanError('missing or duplicate step name: {}'.format(name))
+        names.add(name)
+        if ('run' in step) == ('commands' in step):
+            raise PlanError('step {!r} needs either run or commands'.format(
+                name))
+        if 'run' in step and step['run'] not in ACTIONS:
+            raise PlanError('step {!r}: unknown action {!r}'.format(
+                name, step['run']))
+        if step.get('category', 'misc') not in CATEGORIES:
+            raise PlanError('step {!r}: unknown category {!r}'.format(
+                name, step['category']))
+        for command in step.get('commands', []):
+            if 'samples' in command:
+                _validate_sampled_read(name, command)
+    for step in plan['steps']:
+        for required in step.get('requires', []):
+            if required not in names:
+                raise PlanError('step {!r} requires unknown step {!r}'.format(
+                    step['name'], required))
+    for category, limit in plan.get('fail_fast', {}).items():
+        if category not in CATEGORIES:
+            raise PlanError('fail_fast: unknown category {!r}'.format(
+                category))
+        if not isinstance(limit, int) or limit < 1:
+            raise PlanError('fail_fast: {!r} needs a positive number of'
+                            ' failed checks'.format(category))
+
+
+def _validate_sampled_read(name, command):
+    '''Check the number of samples and expected statistics of a read.'''
+    samples = command['samples']
+    if not isinstance(samples, int) or samples < 2:
+        raise PlanError('step {!r}: {!r} needs 2 or more samples'.format(
+            name, command['command']))
+    if not command['command'].startswith('F42 '):
+        raise PlanError('step {!r}: only pin reads can be sampled, not'
+                        ' {!r}'.format(name, command['command']))
+    conditions = command.get('expected', 'P').split(' ')[1:]
+    if not all(STATISTIC_CONDITION.match(word) for word in conditions):
+        raise PlanError('step {!r}: expected statistics of {!r} must be like'
+                        ' `P59 mean>1000 sd<20`'.format(
+                            name, command['command']))
+
+
+def _count_dependents(requires):
+    '''Number of steps that depend on each step, directly or indirectly.'''
+    dependents = dict((name, set()) for name in requires)
+
+    def add(name, dependent):
+        '''Add a dependent to the step and the steps it requires.'''
+        for required in requires[name]:
+            if dependent not in dependents[required]:
+                dependents[required].add(dependent)
+                add(required, dependent)
+    for name in requires:
+        add(name, name)
+    return dict((name, len(steps)) for name, steps in dependents.items())
+
+
+def history_priorities(plan, failure_rates):
+    '''Priority of each step: the failure rate of its category.'''
+    return dict((step['name'],
+                 failure_rates.get(step.get('category', 'misc'), 0))
+                for step in plan['steps'])
+
+
+def compile_plan(plan, board, priorities=None):
+    '''Order the steps for the board into stages that respect dependencies.
+
+    Returns a list of `(kind, steps)` stages. A `batch` stage holds all
+    command steps that are ready at that point, to be sent together. A
+    `run` stage holds one action step. Among ready steps, those with the
+    highest `priorities` (step name: number, for example the historical
+    failure rate) run first, then the action that most other steps depend
+    on; a batch goes before actions of equal priority. Requirements on
+    steps left out for the board are ignored.
+    '''
+    priorities = priorities or {}
+    steps = [step for step in plan['steps']
+             if board in step.get('boards', [board])]
+    included = set(step['name'] for step in steps)
+    requires = dict((step['name'], set(step.get('requires', [])) & included)
+                    for step in steps)
+    dependents = _count_dependents(requires)
+    order = dict((step['name'], i) for i, step in enumerate(steps))
+    done = set()
+    schedule = []
+    while steps:
+        ready = [step for step in steps if requires[step['name']] <= done]
+        if not ready:
+            raise PlanError('circular requirements: {}'.format(
+                ', '.join(step['name'] for step in steps)))
+        batch = [step for step in ready if 'commands' in step]
+        actions = [step for step in ready if 'run' in step]
+        if batch and (not actions or max(
+                priorities.get(step['name'], 0) for step in batch) >= max(
+                    priorities.get(step['name'], 0) for step in actions)):
+            schedule.append(('batch', batch))
+        else:
+            batch = [min(actions, key=lambda step: (
+                -priorities.get(step['name'], 0), -dependents[step['name']],
+                order[step['name']]))]
+            schedule.append(('run', batch))
+        for step in batch:
+            done.add(step['name'])
+            steps.remove(step)
+    return schedule
+
+
+def print_schedule(schedule):
+    '''Print the stages of a compiled plan.'''
+    for number, (kind, steps) in enumerate(schedule, 1):
+        if kind == 'run':
+            print('{}. {} ({})'.format(number, steps[0]['name'],
+                                       steps[0]['run']))
+        else:
+            print('{}. {} ({} commands)'.format(
+                number, ', '.join(step['name'] for step in steps),
+                sum(len(step['commands']) for step in steps)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: python plan_compiler.py <plan file> <board>')
+        sys.exit(1)
+    print_schedule(compile_plan(load_plan(sys.argv[1]), sys.argv[2]))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+'''Response timeouts from planned motion and observed command latency.'''
+
+from __future__ import division
+import math
+from collections import deque
+from telemetry import AXES, parse_position
+
+MIN_TIMEOUT = 0.5  # seconds
+INITIAL_TIMEOUT = 2  # seconds, until a command code has been answered
+LATENCY_SAMPLES = 50  # recent round-trip times kept per command code
+LATENCY_MARGIN = 4  # timeout multiple of the slowest recent round trip
+MOTION_MARGIN = 1.5  # timeout multiple of the planned move time
+UNRESPONSIVE_AFTER = 3  # consecutive timeouts before waits are shortened
+UNRESPONSIVE_TIMEOUT = 0.05  # seconds to wait while the board is unresponsive
+
+
+def axis_move_time(distance, acceleration, min_speed, max_speed):
+    '''Seconds to move an axis, with speed rising linearly from min to max
+    speed over the first `acceleration` steps (and falling at the end).'''
+    distance = abs(distance)
+    if distance == 0:
+        return 0.0
+    min_speed = max(min_speed, 1)
+    max_speed = max(max_speed, min_speed)
+    ramp = min(acceleration, distance / 2)
+    ramp_speed = min_speed + (max_speed - min_speed) * ramp / max(
+        acceleration, 1)
+    if ramp_speed > min_speed:
+        ramp_time = ramp * math.log(ramp_speed / min_speed) / (
+            ramp_speed - min_speed)
+    else:
+        ramp_time = ramp / min_speed
+    return 2 * ramp_time + (distance - 2 * ramp) / max_speed
+
+
+class ResponseTimeouts(object):
+    '''Choose how long to wait for the response to each command.
+
+    `parameters` are the firmware parameter values (number: value) used to
+    plan moves. Round-trip times are learned from observed command timings.
+    '''
+
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.latencies = {}
+        self.position = dict((axis, 0.0) for axis in AXES)
+        self.consecutive_timeouts = 0
+
+    def observe(self, timing):
+        '''Learn the round-trip time of an answered command (CommandTiming).'''
+        if timing.finished is None:
+            return
+        self.consecutive_timeouts = 0
+        if timing.code.startswith('G'):
+            return  # depends on the distance moved
+        self.latencies.setdefault(
+            timing.code, deque(maxlen=LATENCY_SAMPLES)).append(
+                timing.received - timing.sent)
+
+    def observe_response(self, response):
+        '''Track the reported motor position (R82) to plan the next move.
+        A reply to a command (even a late one) or a restart message shows
+        the board is responding again; periodic status reports do not.'''
+        if (response.q_tag not in (None, '0')
+                or 'STARTUP COMPLETE' in response.line):
+            self.consecutive_timeouts = 0
+        if response.code == 'R82':
+            position = parse_position(response.fields)
+            if position is not None:
+                self.position = position
+
+    def timed_out(self):
+        '''Count a response timeout.'''
+        self.consecutive_timeouts += 1
+
+    def unresponsive(self):
+        '''Determine if the board has stopped responding.'''
+        return self.consecutive_timeouts >= UNRESPONSIVE_AFTER
+
+    def limit(self, timeout):
+        '''Shorten a wait for a command reply while the board is
+        unresponsive.'''
+        return UNRESPONSIVE_TIMEOUT if self.unresponsive() else timeout
+
+    def move_time(self, command):
+        '''Planned seconds for a move command (`G00 X200 Y0 Z0`). Axes
+        that are not given do not move.'''
+        target = dict(self.position)
+        target.update(parse_position(command.split(' ')[1:], required=()))
+        return max([axis_move_time(
+            target[axis] - self.position[axis],
+            self.parameters.get(41 + i, 0), self.parameters.get(61 + i, 0),
+            self.parameters.get(71 + i, 0)) for i, axis in enumerate(AXES)])
+
+    def for_command(self, command):
+        '''Seconds to wait for the response to a command.'''
+        code = command.split(' ')[0]
+        if code.startswith('G'):  # not shortened: moves take seconds
+            return MIN_TIMEOUT + MOTION_MARGIN * self.move_time(command)
+        if self.latencies.get(code):
+            timeout = max(MIN_TIMEOUT,
+                          LATENCY_MARGIN * max(self.latencies[code]))
+        else:
+            timeout = INITIAL_TIMEOUT
+        return self.limit(timeout)
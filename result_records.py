@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+'''Test result records and their machine-readable export formats.'''
+
+from __future__ import print_function
+import csv
+import json
+import sys
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+FIELDS = ['test', 'category', 'command', 'received', 'values', 'expected',
+          'result', 'latency', 'timestamp']
+
+
+class TestRecord(namedtuple('TestRecord', FIELDS)):
+    '''Result of a single check (latency in seconds, UNIX timestamp).'''
+    __slots__ = ()
+
+
+def export_json(filename, records, info):
+    '''Save board info, summary, and test records as JSON.'''
+    data = dict(info)
+    data['records'] = [record._asdict() for record in records]
+    with open(filename, 'w') as json_file:
+        json.dump(data, json_file, indent=2, sort_keys=True)
+
+
+def export_csv(filename, records, _info=None):
+    '''Save test records as CSV (one row per check).'''
+    if sys.version_info[0] < 3:
+        csv_file = open(filename, 'wb')
+    else:
+        csv_file = open(filename, 'w', newline='')
+    with csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(FIELDS)
+        writer.writerows(records)
+
+
+def export_junit(filename, records, info):
+    '''Save test records as JUnit XML (one test suite per category).'''
+    root = ET.Element('testsuites', name='{} board test'.format(
+        info['board']))
+    suites = {}
+    for record in records:
+        if record.category not in suites:
+            suites[record.category] = ET.SubElement(
+                root, 'testsuite', name=record.category, tests='0',
+                failures='0', time='0')
+            properties = ET.SubElement(suites[record.category], 'properties')
+            ET.SubElement(properties, 'property', name='firmware',
+                          value=str(info['firmware']))
+        suite = suites[record.category]
+        suite.set('tests', str(int(suite.get('tests')) + 1))
+        latency = record.latency or 0
+        suite.set('time', '{:.3f}'.format(float(suite.get('time')) + latency))
+        case = ET.SubElement(suite, 'testcase', name=record.test,
+                             classname=record.category,
+                             time='{:.3f}'.format(latency))
+        if record.result != 'PASS':
+            suite.set('failures', str(int(suite.get('failures')) + 1))
+            failure = ET.SubElement(case, 'failure', message='{}: {}'.format(
+                record.command, record.result))
+            failure.text = 'RECEIVED: {}\nVALUE(S): {}\nEXPECTED: {}'.format(
+                record.received, record.values, record.expected)
+    ET.ElementTree(root).write(filename, encoding='utf-8',
+                               xml_declaration=True)
+
+
+EXPORTERS = {
+    'json': ('.json', export_json),
+    'csv': ('.csv', export_csv),
+    'junit': ('.xml', export_junit),
+    }
+
+
+def export_records(base_filename, records, info, formats):
+    '''Save test records in each requested format. Return the file names.'''
+    filenames = []
+    for export_format in formats:
+        extension, exporter = EXPORTERS[export_format]
+        filename = base_filename + extension
+        exporter(filename, records, info)
+        filenames.append(filename)
+    return filenames
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+'''Keep the results of every test run in a SQLite database.'''
+
+from __future__ import print_function
+import argparse
+import re
+import sqlite3
+
+RESULTS_DATABASE = 'board-test-results.sqlite3'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    board TEXT,
+    firmware TEXT,
+    port TEXT,
+    passed INTEGER,
+    count INTEGER,
+    duration REAL);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    test TEXT,
+    category TEXT,
+    command TEXT,
+    pin INTEGER,
+    received TEXT,
+    value TEXT,
+    expected TEXT,
+    passed INTEGER,
+    latency REAL,
+    timestamp REAL);
+CREATE TABLE IF NOT EXISTS encoder_errors (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    test TEXT,
+    axis TEXT,
+    error REAL);
+CREATE TABLE IF NOT EXISTS move_telemetry (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    test TEXT,
+    axis TEXT,
+    samples INTEGER,
+    velocity REAL,
+    acceleration REAL,
+    lag REAL,
+    max_deviation REAL);
+CREATE INDEX IF NOT EXISTS runs_board ON runs(board, date);
+CREATE INDEX IF NOT EXISTS runs_firmware ON runs(firmware, date);
+CREATE INDEX IF NOT EXISTS runs_date ON runs(date);
+CREATE INDEX IF NOT EXISTS results_run ON results(run_id, category);
+CREATE INDEX IF NOT EXISTS results_failed ON results(test) WHERE passed = 0;
+CREATE INDEX IF NOT EXISTS results_pin ON results(pin) WHERE pin IS NOT NULL;
+CREATE INDEX IF NOT EXISTS encoder_errors_run ON encoder_errors(run_id, axis);
+CREATE INDEX IF NOT EXISTS move_telemetry_run ON move_telemetry(run_id, axis);
+'''
+PIN_COMMAND = re.compile(r'^F42 P(\d+)')
+
+
+def axis_errors(values, expected):
+    '''Difference between reported and expected position for each axis.'''
+    if values is None:
+        return []
+    errors = []
+    for actual, target in zip(values.split(' '), expected.split(' ')):
+        try:
+            errors.append((target[0], float(actual[1:]) - float(target[1:])))
+        except (ValueError, IndexError):
+            pass
+    return errors
+
+
+class ResultsStore(object):
+    '''Save test runs and query their history.'''
+
+    def __init__(self, filename=RESULTS_DATABASE):
+        self.database = sqlite3.connect(filename, timeout=30)
+        self.database.executescript(SCHEMA)
+
+    def close(self):
+        '''Close the database.'''
+        self.database.close()
+
+    def save_run(self, info, records):
+        '''Save a test run and its records. Return the run id.'''
+        total = info['summary']['total']
+        with self.database:
+            cursor = self.database.execute(
+                'INSERT INTO runs (date, board, firmware, port, passed, count,'
+                ' duration) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (info['date'], info['board'], info['firmware'], info['port'],
+                 total['passed'], total['count'], total['time']))
+            run_id = cursor.lastrowid
+            self.database.executemany(
+                'INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(run_id, record.test, record.category, record.command,
+                  self._get_pin(record.command), record.received,
+                  record.values, record.expected, record.result == 'PASS',
+                  record.latency, record.timestamp) for record in records])
+            self.database.executemany(
+                'INSERT INTO encoder_errors VALUES (?, ?, ?, ?)',
+                [(run_id, record.test, axis, error) for record in records
+                 if record.test.endswith('encoder')
+                 for axis, error in axis_errors(record.values,
+                                                record.expected)])
+            self.database.executemany(
+                'INSERT INTO move_telemetry VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(run_id, move['test'], axis, metrics['samples'],
+                  metrics['velocity'], metrics['acceleration'],
+                  metrics['lag'], metrics['max_deviation'])
+                 for move in info.get('telemetry', [])
+                 for axis, metrics in sorted(move['axes'].items())])
+        return run_id
+
+    @staticmethod
+    def _get_pin(command):
+        '''Pin number of a pin read command.'''
+        match = PIN_COMMAND.match(command)
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def _run_filter(board=None, firmware=None, since=None, until=None):
+        '''SQL conditions and parameters to select runs.'''
+        conditions, parameters = ['1'], []
+        for column, operator, value in [('board', '=', board),
+                                        ('firmware', '=', firmware),
+                                        ('date', '>=', since),
+                                        ('date', '<', until)]:
+            if value is not None:
+                conditions.append('runs.{} {} ?'.format(column, operator))
+                parameters.append(value)
+        return ' AND '.join(conditions), parameters
+
+    def pass_rates(self, **filters):
+        '''Passed and total checks for each category, and full-pass runs.'''
+        where, parameters = self._run_filter(**filters)
+        rows = self.database.execute(
+            'SELECT category, SUM(results.passed), COUNT(*) FROM results'
+            ' JOIN runs ON runs.id = results.run_id WHERE ' + where +
+            ' GROUP BY category ORDER BY category', parameters).fetchall()
+        runs = self.database.execute(
+            'SELECT SUM(passed = count AND count > 0), COUNT(*) FROM runs'
+            ' WHERE ' + where, parameters).fetchone()
+        return [('boards', runs[0] or 0, runs[1])] + rows
+
+    def pin_failures(self, **filters):
+        '''Failed and total reads for each pin.'''
+        where, parameters = self._run_filter(**filters)
+        return self.database.execute(
+            'SELECT pin, SUM(NOT results.passed), COUNT(*) FROM results'
+            ' JOIN runs ON runs.id = results.run_id WHERE pin IS NOT NULL AND '
+            + where + ' GROUP BY pin ORDER BY SUM(NOT results.passed) DESC',
+            parameters).fetchall()
+
+    def failure_rates(self, **filters):
+        '''Fraction of failed checks in each category and of failed reads of
+        each pin.'''
+        where, parameters = self._run_filter(**filters)
+        categories = self.database.execute(
+            'SELECT category, SUM(NOT results.passed), COUNT(*) FROM results'
+            ' JOIN runs ON runs.id = results.run_id WHERE ' + where +
+            ' GROUP BY category', parameters).fetchall()
+        rates = {'categories': {}, 'pins': {}}
+        for category, failed, count in categories:
+            rates['categories'][category] = float(failed) / count
+        for pin, failed, count in self.pin_failures(**filters):
+            rates['pins'][pin] = float(failed) / count
+        return rates
+
+    def encoder_errors(self, **filters):
+        '''Count, mean, min, and max encoder error (steps) for each axis.'''
+        where, parameters = self._run_filter(**filters)
+        return self.database.execute(
+            'SELECT axis, COUNT(*), AVG(error), MIN(error), MAX(error)'
+            ' FROM encoder_errors JOIN runs ON runs.id = encoder_errors.run_id'
+            ' WHERE ' + where + ' GROUP BY axis ORDER BY axis',
+            parameters).fetchall()
+
+    def encoder_histogram(self, **filters):
+        '''Number of moves for each axis and whole-step encoder error.'''
+        where, parameters = self._run_filter(**filters)
+        return self.database.execute(
+            'SELECT axis, CAST(ROUND(error) AS INTEGER) AS steps, COUNT(*)'
+            ' FROM encoder_errors JOIN runs ON runs.id = encoder_errors.run_id'
+            ' WHERE ' + where + ' GROUP BY axis, steps ORDER BY axis, steps',
+            parameters).fetchall()
+
+    def move_trends(self, **filters):
+        '''Daily mean velocity and lag, and maximum deviation, of each axis.'''
+        where, parameters = self._run_filter(**filters)
+        return self.database.execute(
+            'SELECT axis, SUBSTR(date, 1, 10) AS day, COUNT(*),'
+            ' AVG(velocity), AVG(lag), MAX(max_deviation) FROM move_telemetry'
+            ' JOIN runs ON runs.id = move_telemetry.run_id'
+            ' WHERE samples > 0 AND ' + where +
+            ' GROUP BY axis, day ORDER BY axis, day', parameters).fetchall()
+
+    def failing_tests(self, limit=20, **filters):
+        '''Tests that failed most often.'''
+        where, parameters = self._run_filter(**filters)
+        return self.database.execute(
+            'SELECT test, category, COUNT(*) FROM results'
+            ' JOIN runs ON runs.id = results.run_id'
+            ' WHERE results.passed = 0 AND ' + where +
+            ' GROUP BY test, category ORDER BY COUNT(*) DESC LIMIT ?',
+            parameters + [limit]).fetchall()
+
+
+def print_table(header, rows):
+    '''Print query results as columns.'''
+    row_format = '{:<40}' + '{:>10}' * (len(header) - 1)
+    print(row_format.format(*header))
+    for row in rows:
+        print(row_format.format(*[
+            '{:.2f}'.format(value) if isinstance(value, float) else value
+            for value in row]))
+
+
+def percent(passed, count):
+    '''Pass rate as a whole percentage.'''
+    return int(round(float(passed) / count * 100)) if count else 0
+
+
+def main():
+    '''Query the test results history.'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('query', choices=['yield', 'pins', 'encoders',
+                                          'motion', 'failures'])
+    parser.add_argument('--database', default=RESULTS_DATABASE)
+    parser.add_argument('--board', help='RAMPS or Farmduino')
+    parser.add_argument('--firmware', help='for example 6.4.0.F')
+    parser.add_argument('--since', help='UTC date (YYYY-MM-DD)')
+    parser.add_argument('--until', help='UTC date (YYYY-MM-DD), exclusive')
+    args = parser.parse_args()
+    store = ResultsStore(args.database)
+    filters = {'board': args.board, 'firmware': args.firmware,
+               'since': args.since, 'until': args.until}
+    if args.query == 'yield':
+        print_table(['CATEGORY', 'PASS', 'COUNT', 'PERCENT'], [
+            (name, passed, count, percent(passed, count))
+            for name, passed, count in store.pass_rates(**filters)])
+    elif args.query == 'pins':
+        print_table(['PIN', 'FAILED', 'COUNT', 'PERCENT'], [
+            (pin, failed, count, percent(failed, count))
+            for pin, failed, count in store.pin_failures(**filters)])
+    elif args.query == 'encoders':
+        print_table(['AXIS', 'MOVES', 'MEAN', 'MIN', 'MAX'],
+                    store.encoder_errors(**filters))
+        print()
+        print_table(['AXIS', 'ERROR', 'MOVES'],
+                    store.encoder_histogram(**filters))
+    elif args.query == 'motion':
+        print_table(['AXIS', 'DAY', 'MOVES', 'VELOCITY', 'LAG', 'MAX DEV'],
+                    store.move_trends(**filters))
+    elif args.query == 'failures':
+        print_table(['TEST', 'CATEGORY', 'FAILED'],
+                    store.failing_tests(**filters))
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
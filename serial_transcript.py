@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+'''Record the serial byte stream of a test run and replay it offline.'''
+
+from __future__ import print_function
+import gzip
+import json
+import threading
+import time
+from firmware_io import LINE_ENDING, parse_response
+
+TRANSCRIPT_VERSION = 1
+REPLAY_LOOKAHEAD = 50  # recorded commands searched to resynchronize
+SENT = 'w'
+RECEIVED = 'r'
+CLEARED = 'c'  # queued responses discarded
+TIMED_OUT = 't'  # a wait for a response timed out
+
+
+def _split_q_tag(command):
+    '''Split the queue tag from a command line (`F21 P11 Q12`).'''
+    parts = command.split(' ')
+    if len(parts) > 1 and parts[-1].startswith('Q'):
+        return ' '.join(parts[:-1]), parts[-1][1:]
+    return command, None
+
+
+class TranscriptRecorder(object):
+    '''Save timestamped data sent to and received from a board.
+
+    The transcript is a gzip-compressed file of JSON lines: a header
+    object, then `[seconds, kind, data]` events. The kind is `w` (sent) or
+    `r` (received) with the raw bytes decoded as Latin-1, or `c` (queued
+    responses cleared) or `t` (response timeout) with empty data.
+    '''
+
+    def __init__(self, filename, header):
+        self.file = gzip.open(filename, 'wb')
+        self.start = time.time()
+        self.lock = threading.Lock()
+        header = dict(header, version=TRANSCRIPT_VERSION, started=self.start)
+        self._write_line(json.dumps(header, sort_keys=True))
+
+    def _write_line(self, text):
+        '''Write a line to the transcript file.'''
+        self.file.write((text + '\n').encode())
+
+    def _add(self, timestamp, kind, data=b''):
+        '''Add an event.'''
+        event = [round(timestamp - self.start, 6), kind,
+                 data.decode('latin-1')]
+        with self.lock:
+            if self.file is not None:
+                self._write_line(json.dumps(event))
+
+    def sent(self, timestamp, data):
+        '''Add data written to the board.'''
+        self._add(timestamp, SENT, data)
+
+    def received(self, timestamp, data):
+        '''Add data read from the board.'''
+        self._add(timestamp, RECEIVED, data)
+
+    def cleared(self, timestamp):
+        '''Add the discarding of queued responses.'''
+        self._add(timestamp, CLEARED)
+
+    def timed_out(self, timestamp):
+        '''Add a response timeout.'''
+        self._add(timestamp, TIMED_OUT)
+
+    def close(self):
+        '''Finish the transcript.'''
+        with self.lock:
+            self.file.close()
+            self.file = None
+
+
+def read_transcript(filename):
+    '''Load a transcript. Return the header and the list of events.'''
+    with gzip.open(filename, 'rb') as transcript:
+        header = json.loads(transcript.readline().decode())
+        events = [json.loads(line.decode()) for line in transcript]
+    return header, events
+
+
+def write_transcript(filename, header, events):
+    '''Save a header and list of events as a transcript.'''
+    with gzip.open(filename, 'wb') as transcript:
+        transcript.write((json.dumps(header, sort_keys=True) + '\n').encode())
+        for event in events:
+            transcript.write((json.dumps(event) + '\n').encode())
+
+
+def event_lines(events):
+    '''Split sent and received data into lines. Yield `(seconds, kind,
+    line)` for each line, clear, and timeout (with a line of None).'''
+    partial = {SENT: '', RECEIVED: ''}
+    for timestamp, kind, data in events:
+        if kind not in partial:
+            yield timestamp, kind, None
+            continue
+        lines = (partial[kind] + data).split(LINE_ENDING)
+        partial[kind] = lines.pop()
+        for line in lines:
+            yield timestamp, kind, line
+
+
+class TranscriptReplay(object):
+    '''Answer commands with the responses of a recorded transcript.
+
+    Stands in for both the serial port (`write`) and the LineReader
+    (`read_response`) of a connection. Time is simulated, so responses
+    are returned without waiting, and clears and timeouts happen where
+    they were recorded. Commands that differ from the recording are
+    resynchronized with the next matching recorded command; reads that
+    differ get responses received before the next recorded command or
+    within the timeout.
+    '''
+
+    def __init__(self, events):
+        self.sent = []
+        self.events = []
+        for timestamp, kind, line in event_lines(events):
+            if kind == SENT:
+                command, q_tag = _split_q_tag(line.strip())
+                self.sent.append((timestamp, command, q_tag))
+            else:
+                self.events.append((timestamp, kind, line))
+        self.next_sent = 0
+        self.next_event = 0
+        self.clock = 0.0
+        self.offset = time.time()
+        self.q_tags = {}
+        self.mismatches = []
+        self.running = True
+
+    def start(self):
+        '''Begin replay (responses are available immediately).'''
+        self.running = True
+
+    def stop(self):
+        '''End replay.'''
+        self.running = False
+
+    def close(self):
+        '''End replay.'''
+        self.running = False
+
+    def write(self, data):
+        '''Match a command to the next matching recorded command.'''
+        command, q_tag = _split_q_tag(data.decode('ascii').strip())
+        last = min(len(self.sent), self.next_sent + REPLAY_LOOKAHEAD)
+        for index in range(self.next_sent, last):
+            timestamp, recorded, recorded_tag = self.sent[index]
+            if recorded == command:
+                break
+        else:
+            self.mismatches.append(command)
+            return len(data)
+        if index > self.next_sent:
+            self.mismatches.append(command)
+        self.next_sent = index + 1
+        self.clock = max(self.clock, timestamp)
+        self.offset = time.time() - self.clock
+        self.q_tags.pop('0', None)
+        if recorded_tag is None:  # sent untagged: its responses were Q0
+            recorded_tag = '0'
+        self.q_tags[recorded_tag] = q_tag or '0'
+        return len(data)
+
+    def _next_command_time(self):
+        '''Time the next recorded command was sent.'''
+        if self.next_sent < len(self.sent):
+            return self.sent[self.next_sent][0]
+        return float('inf')
+
+    def clear(self):
+        '''Discard responses up to the next recorded clear (or, if there
+        is none before the next recorded command, up to that command).
+        Return the discarded responses.'''
+        until = self._next_command_time()
+        end = index = self.next_event
+        while index < len(self.events) and self.events[index][0] <= until:
+            if self.events[index][1] == CLEARED:
+                end = index + 1
+                break
+            index += 1
+        else:
+            while end < len(self.events) and self.events[end][0] < until:
+                end += 1
+        discarded = [parse_response(line, timestamp + self.offset)
+                     for timestamp, kind, line in self.events[
+                         self.next_event:end] if kind == RECEIVED]
+        self.next_event = end
+        return discarded
+
+    def read_response(self, timeout):
+        '''Return the next response, or None if none was received in time.'''
+        deadline = time.time() - self.offset + timeout
+        while self.next_event < len(self.events):
+            timestamp, kind, line = self.events[self.next_event]
+            if kind == CLEARED:
+                self.next_event += 1
+                continue
+            if kind == TIMED_OUT:
+                self.next_event += 1
+                self.clock = max(self.clock, timestamp)
+                return None
+            if (timestamp >= self._next_command_time()
+                    and timestamp > deadline):
+                break
+            self.next_event += 1
+            self.clock = max(self.clock, timestamp)
+            response = parse_response(line, timestamp + self.offset)
+            if response.q_tag in self.q_tags:
+                response = response._replace(
+                    q_tag=self.q_tags[response.q_tag])
+            return response
+        self.clock = max(self.clock, deadline)
+        return None
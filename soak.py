@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+'''Burn in a board by repeating the movement and pin tests.'''
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import sys
+import time
+from electronics_test import FarmduinoTestSuite, CarbonCopy
+from plan_compiler import compile_plan, load_plan
+from results_store import axis_errors
+from streaming_stats import QuantileSketch, RunningStats
+
+SOAK_CATEGORIES = ['movement', 'pins']  # repeated; other steps run once
+CHECKPOINT_FILE = 'soak_checkpoint.json'
+CHECKPOINT_INTERVAL = 60  # seconds between checkpoints
+PERCENTILES = [50, 95, 99]
+
+
+class SoakMonitor(object):
+    '''Running results of a soak test, flagging intermittent checks.
+
+    Memory does not grow with the number of cycles: values are added to
+    running statistics, and only a pass/fail count is kept per check.
+    '''
+
+    def __init__(self, console):
+        self.console = console
+        self.start = time.time()
+        self.cycle = 0  # completed soak cycles
+        self.checks = {}  # category: passed and count
+        self.tests = {}  # test name: passed and failed cycles
+        self.intermittent = []
+        self.encoder_errors = {}  # axis: RunningStats
+        self.latencies = {}  # command code: QuantileSketch
+        self.timeouts = 0
+
+    def add_record(self, record):
+        '''Add a check result (TestRecord), flagging it if intermittent.'''
+        passed = record.result == 'PASS'
+        checks = self.checks.setdefault(
+            record.category, {'passed': 0, 'count': 0})
+        checks['count'] += 1
+        checks['passed'] += passed
+        if record.test.endswith('encoder'):
+            for axis, error in axis_errors(record.values, record.expected):
+                self.encoder_errors.setdefault(
+                    axis, RunningStats()).add(error)
+        test = self.tests.setdefault(record.test, {'passed': 0, 'failed': 0})
+        test['passed' if passed else 'failed'] += 1
+        if (test['passed'] and test['failed']
+                and record.test not in self.intermittent):
+            self.intermittent.append(record.test)
+            print('INTERMITTENT: {} {} in cycle {} ({} passed, {} failed)'
+                  .format(record.test, record.result, self.cycle + 1,
+                          test['passed'], test['failed']), file=self.console)
+
+    def add_timing(self, timing):
+        '''Add the round-trip time of a command (CommandTiming).'''
+        self.latencies.setdefault(timing.code, QuantileSketch()).add(
+            timing.phases()['total'])
+
+    def summary(self):
+        '''Results so far.'''
+        latencies = {}
+        for code, sketch in self.latencies.items():
+            latencies[code] = {'count': sketch.count,
+                               'max': round(sketch.maximum * 1000, 3)}
+            for percent in PERCENTILES:
+                latencies[code]['p{}'.format(percent)] = round(
+                    sketch.quantile(percent / 100.) * 1000, 3)
+        return {
+            'cycles': self.cycle,
+            'elapsed': round(time.time() - self.start, 1),
+            'checks': self.checks,
+            'timeouts': self.timeouts,
+            'intermittent': self.intermittent,
+            'encoder_errors': dict((axis, stats.summary()) for axis, stats
+                                   in self.encoder_errors.items()),
+            'latency_ms': latencies,
+            }
+
+
+class SoakSuite(FarmduinoTestSuite):
+    '''Test suite that passes each result to a soak monitor as it is made.'''
+
+    def __init__(self, port, monitor):
+        super(SoakSuite, self).__init__(port)
+        self.monitor = monitor
+        self.timing.add_hook(monitor.add_timing)
+
+    def record_result(self, command_io, test_type, part=None):
+        '''Save the result of a test and add it to the monitor.'''
+        super(SoakSuite, self).record_result(command_io, test_type, part)
+        self.monitor.add_record(self.records[-1])
+
+    def end_cycle(self):
+        '''Drop the per-check data of a cycle once it is in the monitor.'''
+        self.monitor.timeouts = self.timing.timeouts
+        del self.records[:]
+        del self.timing.timings[:]
+        del self.move_metrics[:]
+
+
+def save_checkpoint(summary, filename):
+    '''Replace the checkpoint file with the summary.'''
+    with open(filename + '.tmp', 'w') as checkpoint_file:
+        json.dump(summary, checkpoint_file, indent=2, sort_keys=True)
+    os.rename(filename + '.tmp', filename)  # never leave a partial file
+
+
+def print_progress(summary, console):
+    '''Print a one-line summary.'''
+    passed = sum(checks['passed'] for checks in summary['checks'].values())
+    count = sum(checks['count'] for checks in summary['checks'].values())
+    print('cycle {cycles} ({elapsed} s): {passed}/{count} checks passed,'
+          ' {timeouts} timeouts, {intermittent} intermittent'.format(
+              passed=passed, count=count,
+              intermittent=len(summary['intermittent']), **summary),
+          file=console)
+
+
+def run_soak(port, cycles=None, duration=None, board='1', plan_file=None,
+             checkpoint_file=CHECKPOINT_FILE):
+    '''Run the tests once, then repeat the soak phases until the number of
+    cycles or the duration (seconds) is reached. Return the summary.'''
+    console = sys.stdout
+    monitor = SoakMonitor(console)
+    suite = SoakSuite(port, monitor)
+    devnull = open(os.devnull, 'w')
+    sys.stdout = suite.copy_stdout = CarbonCopy(stdout=devnull, copy=False)
+    try:
+        suite.options = {'prompts': False, 'verbose': False}
+        suite.set_newline()
+        suite.select_board(auto_run=True, board=board)
+        suite.connect_to_board(auto_run=True)
+        schedule = compile_plan(load_plan(plan_file),
+                                suite.board_info['board'])
+        repeated = [stage for stage in schedule if all(
+            step.get('category', 'misc') in SOAK_CATEGORIES
+            for step in stage[1])]
+        suite.run_plan([stage for stage in schedule
+                        if stage not in repeated])
+        suite.end_cycle()
+        last_checkpoint = time.time()
+        try:
+            while ((cycles is None or monitor.cycle < cycles) and
+                   (duration is None
+                    or time.time() - monitor.start < duration)):
+                suite.run_plan(repeated)
+                suite.end_cycle()
+                monitor.cycle += 1
+                if time.time() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    last_checkpoint = time.time()
+                    save_checkpoint(monitor.summary(), checkpoint_file)
+                    print_progress(monitor.summary(), console)
+        except KeyboardInterrupt:
+            print('Interrupted.', file=console)
+        suite.exit(auto_run=True)
+    finally:
+        sys.stdout = console
+        devnull.close()
+    summary = monitor.summary()
+    summary['board'] = suite.board_info['firmware']
+    save_checkpoint(summary, checkpoint_file)
+    return summary
+
+
+def print_report(summary):
+    '''Print the soak test summary.'''
+    print('{line}\nSOAK RESULTS ({cycles} cycles, {elapsed} s, {board})\n'
+          '{line}'.format(line='=' * 60, **summary))
+    print('{:12}{:>8}{:>8}'.format('CATEGORY', 'PASS', 'COUNT'))
+    for category, checks in sorted(summary['checks'].items()):
+        print('{:12}{:>8}{:>8}'.format(
+            category, checks['passed'], checks['count']))
+    print('Response timeouts: {}'.format(summary['timeouts']))
+    row = '{:12}{:>8}{:>10}{:>10}{:>10}{:>10}'
+    print(row.format('AXIS', 'MOVES', 'MEAN', 'VARIANCE', 'MIN', 'MAX'))
+    for axis, stats in sorted(summary['encoder_errors'].items()):
+        print(row.format(axis, stats['count'], stats['mean'],
+                         stats['variance'], stats['min'], stats['max']))
+    print(row.format('COMMAND', 'COUNT', 'P50 (ms)', 'P95', 'P99', 'MAX'))
+    for code, latency in sorted(summary['latency_ms'].items()):
+        print(row.format(code, latency['count'], latency['p50'],
+                         latency['p95'], latency['p99'], latency['max']))
+    for test in summary['intermittent']:
+        print('INTERMITTENT: {}'.format(test))
+    print('=' * 60)
+
+
+def main():
+    '''Run a soak test against a connected or simulated board.'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port',
+                        help='board port (default: simulated board)')
+    cycles = parser.add_mutually_exclusive_group()
+    cycles.add_argument('--cycles', type=int,
+                        help='number of soak cycles (default 10)')
+    cycles.add_argument('--duration', type=float,
+                        help='soak time in hours')
+    parser.add_argument('--board', choices=['0', '1'], default='1',
+                        help='0 for RAMPS, 1 for Farmduino')
+    parser.add_argument('--plan', help='test plan file (default plan if not'
+                        ' provided)')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_FILE,
+                        help='summary file, updated every {} s'.format(
+                            CHECKPOINT_INTERVAL))
+    parser.add_argument('--time-scale', type=float, default=10.0,
+                        help='simulated board speed-up')
+    args = parser.parse_args()
+    duration = None if args.duration is None else args.duration * 3600
+    if duration is None and args.cycles is None:
+        args.cycles = 10
+
+    simulator = None
+    port = args.port
+    if port is None:
+        from firmware_simulator import FirmwareSimulator
+        simulator = FirmwareSimulator(
+            board='R' if args.board == '0' else 'F',
+            time_scale=args.time_scale, seed=0)
+        simulator.start()
+        port = simulator.port
+    try:
+        summary = run_soak(port, args.cycles, duration, args.board,
+                           args.plan, args.checkpoint)
+    finally:
+        if simulator is not None:
+            simulator.stop()
+    print_report(summary)
+    if summary['intermittent']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+'''Test several boards at the same time.'''
+
+from __future__ import print_function
+import argparse
+import os
+import sys
+import threading
+import time
+from board_discovery import PortWatcher, candidate_ports
+from electronics_test import FarmduinoTestSuite, CarbonCopy
+
+REFRESH_INTERVAL = 0.5  # seconds
+COLUMNS = '{:22}{:11}{:13}{:16}{:>8}{:>12}'
+
+
+class ThreadOutput(object):
+    '''Route stdout writes to the output registered by the writing thread.'''
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def register(self, output):
+        '''Send output written by the current thread to `output`.'''
+        self.local.output = output
+
+    def _current(self):
+        '''Output registered by the current thread.'''
+        return getattr(self.local, 'output', self.default)
+
+    def write(self, text):
+        '''Write to the output of the current thread.'''
+        self._current().write(text)
+
+    def flush(self):
+        '''Flush the output of the current thread.'''
+        self._current().flush()
+
+    def __getattr__(self, name):
+        '''Use color and copy methods of the current thread's output.'''
+        return getattr(self._current(), name)
+
+
+def results_file_for(port):
+    '''Results file name template for the board on the provided port.'''
+    port_name = os.path.basename(port).replace(':', '')
+    return '{board}_' + port_name + '_board-test-results.txt'
+
+
+class TestStation(object):
+    '''Run the full test suite on several boards in parallel.'''
+
+    def __init__(self, ports, fail_fast=False):
+        self.fail_fast = fail_fast
+        self.boards = []
+        for port in ports:
+            self._add_board(port)
+        self.stdout = sys.stdout
+        self.devnull = None
+
+    def _add_board(self, port):
+        '''Create a test suite for the board on the port.'''
+        suite = FarmduinoTestSuite(port)
+        suite.results_file = results_file_for(port)
+        suite.fail_fast = self.fail_fast
+        board = {'port': port, 'suite': suite, 'error': None,
+                 'start': None, 'end': None, 'thread': None}
+        self.boards.append(board)
+        return board
+
+    def _start_board(self, board):
+        '''Start testing a board in its own thread.'''
+        board['thread'] = threading.Thread(
+            target=self._run_board, args=(board,))
+        board['thread'].daemon = True
+        board['thread'].start()
+
+    def add_board(self, port):
+        '''Start testing a board plugged in while the station is running.'''
+        self._start_board(self._add_board(port))
+
+    def _run_board(self, board):
+        '''Run the test suite for one board (in its own thread).'''
+        board['start'] = time.time()
+        suite = board['suite']
+        suite.copy_stdout = CarbonCopy(stdout=self.devnull)
+        sys.stdout.register(suite.copy_stdout)
+        try:
+            suite.run(auto_run=True)
+        except SystemExit:
+            board['error'] = 'no firmware'
+        except Exception as error:  # keep the other boards running
+            board['error'] = str(error) or type(error).__name__
+        board['end'] = time.time()
+
+    @staticmethod
+    def _board_status(board):
+        '''Status table row for a board.'''
+        suite = board['suite']
+        total = suite.test_results['total']
+        if board['error'] is not None:
+            status = 'ERROR: {}'.format(board['error'])
+        else:
+            status = suite.status or 'waiting'
+        if board['start'] is None:
+            elapsed = 0
+        else:
+            elapsed = (board['end'] or time.time()) - board['start']
+        return COLUMNS.format(
+            board['port'], suite.board_info['board'] or '',
+            suite.board_info['firmware'] or '', status,
+            '{}/{}'.format(total['passed'], total['count']),
+            '{:.1f}'.format(elapsed))
+
+    def status_table(self):
+        '''Combined status of all boards.'''
+        lines = [COLUMNS.format(
+            'PORT', 'BOARD', 'FIRMWARE', 'STATUS', 'PASSED', 'TIME (sec)')]
+        lines.extend(self._board_status(board) for board in list(self.boards))
+        return lines
+
+    def _display(self, previous):
+        '''Print the status table, redrawing it in place on a terminal.'''
+        table = self.status_table()
+        if table == previous:
+            return table
+        if previous and self.stdout.isatty():
+            self.stdout.write('\033[{}F'.format(len(previous)))
+        for line in table:
+            self.stdout.write(line + '\033[K\n' if self.stdout.isatty()
+                              else line + '\n')
+        self.stdout.flush()
+        return table
+
+    def _testing(self):
+        '''Determine if any board is still being tested.'''
+        return any(board['thread'].is_alive() for board in list(self.boards))
+
+    def run(self, watch=False):
+        '''Test all boards and display live status until they finish.
+
+        With `watch`, also test each board plugged in until interrupted.
+        '''
+        self.devnull = open(os.devnull, 'w')
+        sys.stdout = ThreadOutput(self.stdout)
+        watcher = None
+        if watch:
+            watcher = PortWatcher(self.add_board, ignore_current=True)
+            watcher.ports.update(board['port'] for board in self.boards)
+            watcher.start()
+        try:
+            for board in self.boards:
+                self._start_board(board)
+            table = None
+            while watch or self._testing():
+                table = self._display(table)
+                time.sleep(REFRESH_INTERVAL)
+            self._display(table)
+        except KeyboardInterrupt:
+            if self._testing():
+                raise
+        finally:
+            if watcher is not None:
+                watcher.stop()
+            sys.stdout = self.stdout
+            self.devnull.close()
+        for board in self.boards:
+            if board['error'] is None:
+                print('{}: results saved to {}'.format(
+                    board['port'], board['suite'].results_file.format(
+                        board=board['suite'].board_info['board'])))
+
+
+def main():
+    '''Test the provided ports, or all connected boards.'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('ports', nargs='*',
+                        help='board ports (default: all USB serial ports)')
+    parser.add_argument('--watch', action='store_true',
+                        help='also test boards as they are plugged in')
+    parser.add_argument('--fail-fast', action='store_true',
+                        help="stop testing a board at the test plan's"
+                        ' fail_fast limits')
+    args = parser.parse_args()
+    ports = args.ports or candidate_ports()
+    if not ports and not args.watch:
+        print('No boards detected.')
+        sys.exit(1)
+    TestStation(ports, args.fail_fast).run(watch=args.watch)
+
+
+if __name__ == '__main__':
+    main()
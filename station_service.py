@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+'''Keep board connections open and run test jobs sent over a local socket.'''
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+try:
+    import socketserver
+except ImportError:  # Python 2
+    import SocketServer as socketserver
+from board_discovery import PortWatcher, close_board, probe_port
+from electronics_test import FarmduinoTestSuite, CarbonCopy
+from station import ThreadOutput, results_file_for
+
+SERVICE_SOCKET = 'board-test-station.sock'
+IDLE_CLEAR_INTERVAL = 1  # seconds between discarding idle status reports
+STATUS_COLUMNS = '{:22}{:13}{:16}{:>8}'
+
+
+class StreamOutput(object):
+    '''Send suite output to a client line by line (as `output` replies).'''
+
+    def __init__(self, send):
+        self.send = send
+        self.partial = ''
+
+    def write(self, text):
+        '''Send the complete lines of the text.'''
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self.send({'output': line + '\n'})
+
+    def flush(self):
+        '''Send an incomplete line.'''
+        if self.partial:
+            self.send({'output': self.partial})
+            self.partial = ''
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    '''Answer a request (one JSON line) with JSON line replies.
+
+    `{"command": "status"}` replies with the `boards` and their status.
+    `{"command": "test", "port": ..., "plan": ..., "fail_fast": ...}` tests
+    the board, replying with its `output` as it is printed and then the
+    `result` (or an `error`).
+    '''
+
+    def handle(self):
+        '''Run the request.'''
+        self.connected = True
+        try:
+            request = json.loads(self.rfile.readline().decode())
+        except ValueError:
+            self.send({'error': 'invalid request'})
+            return
+        service = self.server.service
+        if request.get('command') == 'status':
+            self.send({'boards': service.status()})
+        elif request.get('command') == 'test':
+            self.send(service.run_job(request, StreamOutput(self.send)))
+        else:
+            self.send({'error': 'unknown command'})
+
+    def send(self, reply):
+        '''Send a reply (the job continues if the client disconnected).'''
+        if not self.connected:
+            return
+        try:
+            self.wfile.write((json.dumps(reply) + '\n').encode())
+            self.wfile.flush()
+        except socket.error:
+            self.connected = False
+
+
+class StationService(object):
+    '''Hold connections to plugged-in boards open and test them on request.
+
+    Boards are probed as soon as their port appears (and the provided
+    ports at startup), so a job starts testing without opening the port or
+    waiting for the firmware to boot.
+    '''
+
+    def __init__(self, ports=None, socket_path=SERVICE_SOCKET):
+        self.ports = ports or []
+        self.socket_path = socket_path
+        self.boards = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.watcher = None
+
+    def add_port(self, port):
+        '''Connect to the board on a new port (in its own thread).'''
+        with self.lock:
+            if port in self.boards:
+                return
+            self.boards[port] = {
+                'port': port, 'firmware': None, 'serial': None,
+                'reader': None, 'status': 'connecting', 'suite': None,
+                'lock': threading.Lock()}
+        thread = threading.Thread(target=self._connect,
+                                  args=(self.boards[port],))
+        thread.daemon = True
+        thread.start()
+
+    @staticmethod
+    def _connect(board):
+        '''Probe the board and keep its connection open.'''
+        found = probe_port(board['port'], keep_open=True)
+        board.update(firmware=found['firmware'], serial=found['serial'],
+                     reader=found['reader'])
+        board['status'] = 'ready' if found['firmware'] else 'no firmware'
+
+    def remove_port(self, port):
+        '''Close the connection to an unplugged board.'''
+        with self.lock:
+            board = self.boards.pop(port, None)
+        if board is not None:
+            close_board(board)
+
+    def status(self):
+        '''Port, firmware, status, and results of each board.'''
+        rows = []
+        with self.lock:
+            boards = sorted(self.boards.items())
+        for port, board in boards:
+            status = board['status']
+            total = {'passed': 0, 'count': 0}
+            if board['suite'] is not None:
+                total = board['suite'].test_results['total']
+                if status == 'testing':
+                    status = board['suite'].status or status
+            rows.append({'port': port, 'firmware': board['firmware'],
+                         'status': status, 'passed': total['passed'],
+                         'count': total['count']})
+        return rows
+
+    def run_job(self, job, output):
+        '''Test a board, printing the suite output to `output`.'''
+        board = self.boards.get(job.get('port'))
+        if board is None:
+            return {'error': 'no board at {}'.format(job.get('port'))}
+        if board['serial'] is None:
+            return {'error': board['status']}
+        if not board['lock'].acquire(False):
+            return {'error': 'busy'}
+        try:
+            suite = FarmduinoTestSuite(board['port'])
+            suite.use_board(board)
+            suite.keep_connection = True
+            suite.results_file = results_file_for(board['port'])
+            suite.plan_file = job.get('plan')
+            suite.fail_fast = job.get('fail_fast', False)
+            suite.copy_stdout = CarbonCopy(stdout=output)
+            sys.stdout.register(suite.copy_stdout)
+            board.update(suite=suite, status='testing')
+            try:
+                suite.run(auto_run=True)
+            except SystemExit:
+                board['status'] = 'no firmware'
+                return {'error': board['status']}
+            except Exception as error:  # keep serving the other boards
+                board['status'] = 'ERROR: {}'.format(
+                    str(error) or type(error).__name__)
+                return {'error': board['status']}
+            finally:
+                output.flush()
+            board['status'] = suite.status
+            return {'result': {
+                'board': suite.board_info['board'],
+                'firmware': suite.board_info['firmware'],
+                'summary': suite.test_results, 'aborted': suite.aborted,
+                'results_file': suite.results_file.format(
+                    board=suite.board_info['board'])}}
+        finally:
+            board['lock'].release()
+
+    def _clear_idle_boards(self):
+        '''Discard the status reports that idle boards send.'''
+        with self.lock:
+            boards = list(self.boards.values())
+        for board in boards:
+            if board['reader'] is not None and board['lock'].acquire(False):
+                board['reader'].clear()
+                board['lock'].release()
+
+    def serve(self):
+        '''Accept jobs until interrupted.'''
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)  # left by a service that was killed
+        self.server = socketserver.ThreadingUnixStreamServer(
+            self.socket_path, JobHandler)
+        self.server.daemon_threads = True
+        self.server.service = self
+        sys.stdout = ThreadOutput(sys.stdout)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        for port in self.ports:
+            self.add_port(port)
+        self.watcher = PortWatcher(self.add_port, self.remove_port)
+        self.watcher.start()
+        # Stop cleanly when run as a system service
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        print('Accepting test jobs at {}'.format(self.socket_path))
+        try:
+            while True:
+                self._clear_idle_boards()
+                time.sleep(IDLE_CLEAR_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.watcher.stop()
+            self.server.shutdown()
+            self.server.server_close()
+            os.remove(self.socket_path)
+            sys.stdout = sys.stdout.default
+            for port in list(self.boards):
+                self.remove_port(port)
+
+
+def send_request(request, socket_path=SERVICE_SOCKET):
+    '''Send a request to the service and yield its replies.'''
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(socket_path)
+    try:
+        connection.sendall((json.dumps(request) + '\n').encode())
+        for line in connection.makefile('rb'):
+            yield json.loads(line.decode())
+    finally:
+        connection.close()
+
+
+def main():
+    '''Run the service, or send it a request.'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('action', choices=['serve', 'status', 'test'])
+    parser.add_argument('ports', nargs='*',
+                        help='serve: ports to connect to in addition to USB'
+                        ' serial ports plugged in; test: the board port')
+    parser.add_argument('--socket', default=SERVICE_SOCKET)
+    parser.add_argument('--plan', help='test plan file')
+    parser.add_argument('--fail-fast', action='store_true')
+    args = parser.parse_args()
+    if args.action == 'serve':
+        StationService(args.ports, args.socket).serve()
+    elif args.action == 'status':
+        print(STATUS_COLUMNS.format('PORT', 'FIRMWARE', 'STATUS', 'PASSED'))
+        for reply in send_request({'command': 'status'}, args.socket):
+            for board in reply['boards']:
+                print(STATUS_COLUMNS.format(
+                    board['port'], board['firmware'] or '', board['status'],
+                    '{}/{}'.format(board['passed'], board['count'])))
+    else:
+        if len(args.ports) != 1:
+            parser.error('test needs one port')
+        passed = False
+        for reply in send_request({
+                'command': 'test', 'port': args.ports[0], 'plan': args.plan,
+                'fail_fast': args.fail_fast}, args.socket):
+            if 'output' in reply:
+                sys.stdout.write(reply['output'])
+            elif 'error' in reply:
+                print('Error: {}'.format(reply['error']))
+            else:
+                total = reply['result']['summary']['total']
+                passed = (total['passed'] == total['count']
+                          and reply['result']['aborted'] is None)
+        sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
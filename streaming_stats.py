@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+'''Running statistics that use constant memory for any number of values.'''
+
+from __future__ import division
+import math
+
+RELATIVE_ACCURACY = 0.01  # quantile sketch error (fraction of the value)
+MIN_SKETCH_VALUE = 1e-6  # smaller values are counted as zero
+
+
+class RunningStats(object):
+    '''Count, mean, variance, minimum, and maximum (Welford's method).'''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.squares = 0.0  # sum of squared differences from the mean
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        '''Add a value.'''
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.squares += delta * (value - self.mean)
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    @property
+    def variance(self):
+        '''Sample variance (0 for fewer than two values).'''
+        if self.count < 2:
+            return 0.0
+        return self.squares / (self.count - 1)
+
+    @property
+    def standard_deviation(self):
+        '''Sample standard deviation.'''
+        return math.sqrt(self.variance)
+
+    def summary(self):
+        '''Statistics as a dictionary.'''
+        return {'count': self.count, 'mean': round(self.mean, 3),
+                'variance': round(self.variance, 3),
+                'min': self.minimum, 'max': self.maximum}
+
+
+class QuantileSketch(object):
+    '''Approximate quantiles of positive values from logarithmic buckets.
+
+    Each quantile is within RELATIVE_ACCURACY of a value that was added.
+    The number of buckets depends only on the range of the values (about
+    700 for one microsecond to one hour), not on how many were added.
+    '''
+
+    def __init__(self):
+        self.gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.maximum = None
+
+    def add(self, value):
+        '''Add a value.'''
+        self.count += 1
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        if value < MIN_SKETCH_VALUE:
+            self.zeros += 1
+            return
+        index = int(math.ceil(math.log(value) / self.log_gamma))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def quantile(self, fraction):
+        '''Approximate value below which the fraction of values fall.'''
+        if self.count == 0:
+            return None
+        rank = fraction * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return min(2 * self.gamma ** index / (self.gamma + 1),
+                           self.maximum)
+        return self.maximum
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+'''Motor and encoder positions reported during moves.'''
+
+from __future__ import division
+from array import array
+
+AXES = ['X', 'Y', 'Z']
+
+
+def parse_position(fields, required=AXES):
+    '''Position of each axis from report fields (`X200 Y0.00 Z0`), or None
+    if a required axis is missing.'''
+    position = {}
+    for field in fields:
+        try:
+            position[field[0]] = float(field[1:])
+        except (ValueError, IndexError):
+            pass
+    if not all(axis in position for axis in required):
+        return None
+    return position
+
+
+class RingBuffer(object):
+    '''Fixed number of floats, overwriting the oldest when full.'''
+
+    def __init__(self, capacity):
+        self.values = array('d', [0.0] * capacity)
+        self.capacity = capacity
+        self.added = 0
+
+    def append(self, value):
+        '''Add a value.'''
+        self.values[self.added % self.capacity] = value
+        self.added += 1
+
+    def __len__(self):
+        '''Number of values kept.'''
+        return min(self.added, self.capacity)
+
+    def __iter__(self):
+        '''Values from oldest to newest.'''
+        for i in range(self.added - len(self), self.added):
+            yield self.values[i % self.capacity]
+
+
+class MoveTelemetry(object):
+    '''Timestamped motor (R82) and encoder (R84) positions during a move.'''
+
+    def __init__(self, capacity):
+        self.timestamps = RingBuffer(capacity)
+        self.motor = dict((axis, RingBuffer(capacity)) for axis in AXES)
+        self.encoder = dict((axis, RingBuffer(capacity)) for axis in AXES)
+        self.motor_position = None
+
+    def add(self, response):
+        '''Add a position report. Other responses are ignored.'''
+        if response.code == 'R82':
+            self.motor_position = parse_position(response.fields)
+        elif response.code == 'R84' and self.motor_position is not None:
+            encoder_position = parse_position(response.fields)
+            if encoder_position is None:
+                return
+            self.timestamps.append(response.timestamp)
+            for axis in AXES:
+                self.motor[axis].append(self.motor_position[axis])
+                self.encoder[axis].append(encoder_position[axis])
+
+    def __len__(self):
+        '''Number of samples kept.'''
+        return len(self.timestamps)
+
+    def velocity_profile(self, axis):
+        '''Motor velocity (steps/s) of the axis between samples.'''
+        times = list(self.timestamps)
+        positions = list(self.motor[axis])
+        profile = []
+        for i in range(1, len(times)):
+            interval = times[i] - times[i - 1]
+            if interval > 0:
+                profile.append(((times[i] + times[i - 1]) / 2,
+                                (positions[i] - positions[i - 1]) / interval))
+        return profile
+
+    def acceleration_profile(self, axis):
+        '''Motor acceleration (steps/s^2) of the axis between samples.'''
+        profile = self.velocity_profile(axis)
+        return [(previous[0], (current[1] - previous[1])
+                 / (current[0] - previous[0]))
+                for previous, current in zip(profile, profile[1:])]
+
+    def metrics(self):
+        '''Peak velocity and acceleration, mean encoder lag (steps behind
+        the motor), and maximum motor/encoder deviation of each axis.'''
+        metrics = {}
+        for axis in AXES:
+            motor = list(self.motor[axis])
+            deviations = [position - encoder for position, encoder
+                          in zip(motor, self.encoder[axis])]
+            direction = 1 if not motor or motor[-1] >= motor[0] else -1
+            velocities = [abs(velocity) for _, velocity
+                          in self.velocity_profile(axis)]
+            accelerations = [abs(acceleration) for _, acceleration
+                             in self.acceleration_profile(axis)]
+            metrics[axis] = {
+                'samples': len(motor),
+                'velocity': round(max(velocities or [0]), 2),
+                'acceleration': round(max(accelerations or [0]), 2),
+                'lag': round(direction * sum(deviations)
+                             / (len(deviations) or 1), 2),
+                'max_deviation': round(max(
+                    [abs(deviation) for deviation in deviations] or [0]), 2),
+                }
+        return metrics